@@ -0,0 +1,154 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from PIL import Image
+
+import Renderer
+from MetadataStore import MetadataStore, STORE_PATH
+from RenderCache import RenderCache, RENDER_CACHE_BYTES, RENDER_CACHE_DIRECTORY, source_signature
+from Structures import Collection, GifImage
+from ThumbnailAtlas import ThumbnailAtlas, THUMBNAIL_SIZE, INDEX_SAVE_INTERVAL, make_thumbnail, thumbnail_bytes
+
+# Images handed to a worker process at a time
+CHUNK_SIZE = 4
+
+# Progress is printed every this many images
+PROGRESS_INTERVAL = 100
+
+
+def prepare_image(job, screen_width, screen_height, thumbnail_size, directory):
+    """Decode one image in a worker process and make what job asks for.
+
+    job is (path, zoom level, make render, make thumbnail). The render is written to the RenderCache in directory
+    from here, the thumbnail is returned as (path, mtime, bytes) for the parent to put in the atlas, since the atlas
+    index lives in the parent. Returns (thumbnail, rendered, error).
+    """
+    path, zoom_level, render, thumbnail = job
+    if not render:
+        return make_thumbnail(path, thumbnail_size), False, None
+
+    signature = source_signature(path)
+    mtime = Renderer.file_mtime(path)
+    try:
+        # Decoded the same way the viewer does, so the render matches what it would have made itself
+        source, original_size = Renderer.load_source(path, screen_width, screen_height, zoom_level)
+        scaled = Renderer.resize_to(source, Renderer.fit_size(*original_size, screen_width, screen_height,
+                                                              zoom_level))
+        # The parent trims the cache once every worker is done
+        RenderCache(directory, max_bytes=None).put(path, zoom_level, screen_width, screen_height, scaled, signature)
+
+        thumbnail_result = None
+        if thumbnail:
+            # The render is usually plenty for a thumbnail and much smaller than the source
+            base = scaled if max(scaled.size) >= thumbnail_size else source
+            thumbnail_result = path, mtime, thumbnail_bytes(base.copy(), thumbnail_size)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return None, False, f"{path}: {e}"
+    return thumbnail_result, True, None
+
+
+def default_zoom_levels(paths, store_path):
+    """path -> default zoom level saved by the viewer, for the images that have one."""
+    if not os.path.exists(store_path):
+        return {}
+    store = MetadataStore(store_path)
+    try:
+        return {path: record["default_zoom_level"] for path, record in store.load_many(paths).items()}
+    finally:
+        store.close()
+
+
+def parse_list(text):
+    items = [item.strip() for item in text.split(",") if item.strip()]
+    return items or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a folder's images and thumbnails ahead of time, without the "
+                                                 "viewer. Images that are already up to date are skipped, so an "
+                                                 "interrupted run can simply be started again")
+    parser.add_argument("folder", help="collection folder, as picked in the viewer")
+    parser.add_argument("--whitelist", default="", help="comma separated group folders to include, at any depth")
+    parser.add_argument("--blacklist", default="", help="comma separated group folders to skip along with their "
+                                                        "subfolders")
+    parser.add_argument("--screen", default="1920x1080", help="screen size the viewer runs at, WIDTHxHEIGHT")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--metadata", default=STORE_PATH, help="metadata store holding the default zoom levels")
+    parser.add_argument("--render-cache", default=RENDER_CACHE_DIRECTORY, help="render cache directory")
+    parser.add_argument("--render-cache-mb", type=int, default=RENDER_CACHE_BYTES // 2 ** 20,
+                        help="size limit of the render cache, the least recently used renders are deleted past it")
+    parser.add_argument("--no-renders", action="store_true", help="only make thumbnails")
+    parser.add_argument("--no-thumbnails", action="store_true", help="only make renders")
+    args = parser.parse_args()
+
+    try:
+        screen_width, screen_height = (int(value) for value in args.screen.lower().split("x"))
+    except ValueError:
+        parser.error(f"--screen should look like 1920x1080, not {args.screen}")
+
+    # Filtered after loading, the same way the viewer does, so nested folders can be whitelisted and blacklisted too
+    collection = Collection(args.folder, os.path.basename(os.path.normpath(args.folder)))
+    collection.load_groups()
+    collection = collection.filtered(parse_list(args.whitelist), parse_list(args.blacklist))
+    images = list({image.path: image for group in collection.groups for image in group.images}.values())
+
+    # Renders are made at the zoom level the viewer will open each image at
+    zoom_levels = default_zoom_levels([image.path for image in images], args.metadata)
+    render_cache = RenderCache(args.render_cache, args.render_cache_mb * 2 ** 20)
+    atlas = None if args.no_thumbnails else ThumbnailAtlas(args.folder)
+
+    jobs = []
+    for image in images:
+        zoom_level = zoom_levels.get(image.path, image.default_zoom_level)
+
+        # GIF frames are rendered by their own path in the viewer, they only get thumbnails
+        render = (not args.no_renders and not isinstance(image, GifImage)
+                  and not render_cache.contains(image.path, zoom_level, screen_width, screen_height))
+        thumbnail = atlas is not None and image.path not in atlas
+        if render or thumbnail:
+            jobs.append((image.path, zoom_level, render, thumbnail))
+
+    print(f"{len(images)} images, {len(images) - len(jobs)} already up to date, {len(jobs)} to do "
+          f"with {args.workers} workers")
+
+    rendered = thumbnails = failed = done = 0
+    start = time.perf_counter()
+    worker = partial(prepare_image, screen_width=screen_width, screen_height=screen_height,
+                     thumbnail_size=THUMBNAIL_SIZE, directory=args.render_cache)
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for thumbnail, was_rendered, error in executor.map(worker, jobs, chunksize=CHUNK_SIZE):
+                done += 1
+                rendered += was_rendered
+                if error is not None:
+                    failed += 1
+                    print(f"Failed: {error}")
+                if thumbnail is not None and thumbnail[2] is not None and atlas is not None:
+                    atlas.put(*thumbnail)
+                    thumbnails += 1
+                    if thumbnails % INDEX_SAVE_INTERVAL == 0:
+                        atlas.save_index()
+                if done % PROGRESS_INTERVAL == 0:
+                    elapsed = time.perf_counter() - start
+                    print(f"{done}/{len(jobs)} images, {done / elapsed:.1f} images/sec")
+    finally:
+        # Renders are already on disk, saving the index keeps the thumbnails of an interrupted run too
+        if atlas is not None:
+            atlas.close()
+
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed else 0.0
+    print(f"Done: {done} images in {elapsed:.1f}s ({rate:.1f} images/sec), {rendered} renders, "
+          f"{thumbnails} thumbnails, {failed} failed")
+
+    removed = render_cache.trim()
+    if removed:
+        print(f"The render cache was over {args.render_cache_mb} MB, {removed} least recently used renders were "
+              f"deleted. Raise --render-cache-mb to keep every render")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import operator
+import threading
+from array import array
+
+from Structures import Group, dirty_tracker
+
+# NumPy is optional, without it the columns are array module arrays and masks are Python ints used as bitsets
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COMPARISONS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+# column name -> (array typecode, NumPy dtype, SmartImage attribute)
+COLUMNS = {
+    "weight": ("d", "float64", "weight"),
+    "favorite": ("b", "bool", "favorite"),
+    "zoom": ("d", "float64", "default_zoom_level"),
+    "panx": ("d", "float64", "default_panx"),
+    "pany": ("d", "float64", "default_pany"),
+    "series_index": ("q", "int64", "index"),
+}
+
+
+class Catalog:
+    """Column oriented copy of the image metadata of a set of groups, for queries across the whole library.
+
+    Every image is a row. Numeric metadata is kept in one array per column, the group of each row in a group id
+    column, and each tag as a bitmap over the rows (a packed tag x row bit matrix with NumPy). Queries build row
+    masks that are combined with &, | and invert(), then turned back into SmartImages with select(). With NumPy the
+    masks are boolean arrays, without it they are Python ints with bit i set for row i.
+
+    Rows are laid out group by group, so the rows of a group are always one contiguous range. Images and groups
+    changed through their mutators are picked up from the dirty tracker before the next query.
+    """
+
+    def __init__(self, groups, use_numpy=None):
+        self.numpy = np is not None if use_numpy is None else use_numpy and np is not None
+        # Virtual groups only hold images of other groups
+        self.groups = [group for group in groups if not group.virtual]
+        self.group_ids = {group: group_id for group_id, group in enumerate(self.groups)}
+
+        self.images = []
+        self.rows = {}
+
+        # (start, end) row range of each group, in group id order
+        self.group_ranges = []
+
+        # Tags of each row as of the last build or refresh, used to update the bitmaps when tags change
+        self.row_tags = []
+
+        # tag -> tag id, and the row bitmap of each tag id
+        self.tag_ids = {}
+        self.tag_bitmaps = []
+
+        self.changed = set()
+        self.lock = threading.Lock()
+
+        self.build()
+        dirty_tracker.add_listener(self.on_change)
+
+    def build(self):
+        columns = {name: [] for name in COLUMNS}
+        group_id_column = []
+        postings = {}
+
+        for group_id, group in enumerate(self.groups):
+            start = len(self.images)
+            for image in group.images:
+                row = len(self.images)
+                self.images.append(image)
+                self.rows[image] = row
+                for name, (_, _, attribute) in COLUMNS.items():
+                    columns[name].append(getattr(image, attribute))
+                group_id_column.append(group_id)
+                self.row_tags.append(image.tags)
+                for tag in image.tags:
+                    postings.setdefault(tag, []).append(row)
+            self.group_ranges.append((start, len(self.images)))
+
+        if self.numpy:
+            self.columns = {name: np.array(values, dtype=COLUMNS[name][1]) for name, values in columns.items()}
+            self.group_id = np.array(group_id_column, dtype="int32")
+            self.group_weight = np.array([group.weight for group in self.groups], dtype="float64")
+        else:
+            self.columns = {name: array(COLUMNS[name][0], values) for name, values in columns.items()}
+            self.group_id = array("l", group_id_column)
+            self.group_weight = array("d", [group.weight for group in self.groups])
+
+        for tag, rows in postings.items():
+            self.tag_ids[tag] = len(self.tag_ids)
+        if self.numpy:
+            matrix = np.zeros((len(postings), len(self.images)), dtype=bool)
+            for tag, rows in postings.items():
+                matrix[self.tag_ids[tag], rows] = True
+            self.tag_bitmaps = np.packbits(matrix, axis=1, bitorder="little")
+        else:
+            self.tag_bitmaps = [self.rows_mask(rows) for rows in postings.values()]
+
+    def close(self):
+        """Stop following changes, used when the catalog is replaced."""
+        dirty_tracker.remove_listener(self.on_change)
+
+    def __len__(self):
+        return len(self.images)
+
+    # ----------------Masks----------------
+
+    def all(self):
+        if self.numpy:
+            return np.ones(len(self.images), dtype=bool)
+        return (1 << len(self.images)) - 1
+
+    def none(self):
+        if self.numpy:
+            return np.zeros(len(self.images), dtype=bool)
+        return 0
+
+    def invert(self, mask):
+        if self.numpy:
+            return ~mask
+        return mask ^ self.all()
+
+    def rows_mask(self, rows):
+        if self.numpy:
+            mask = self.none()
+            mask[list(rows)] = True
+            return mask
+        bits = bytearray((len(self.images) + 7) // 8)
+        for row in rows:
+            bits[row >> 3] |= 1 << (row & 7)
+        return int.from_bytes(bits, "little")
+
+    def mask_rows(self, mask):
+        """Row numbers set in mask, in row order."""
+        if self.numpy:
+            return np.flatnonzero(mask).tolist()
+        return [row for row, bit in enumerate(bin(mask)[:1:-1]) if bit == "1"]
+
+    def count(self, mask):
+        if self.numpy:
+            return int(np.count_nonzero(mask))
+        return bin(mask).count("1")
+
+    def compare(self, column, op, value):
+        """Rows whose column satisfies op ("<", "<=", ">", ">=", "==" or "!=") against value."""
+        self.refresh()
+        compare = COMPARISONS[op]
+        values = self.columns[column]
+        if self.numpy:
+            return compare(values, value)
+        return self.flags_mask(compare(v, value) for v in values)
+
+    def flags_mask(self, flags):
+        # Building the binary string and parsing it once is far faster than setting bits one by one
+        bits = "".join("1" if flag else "0" for flag in flags)[::-1]
+        return int(bits, 2) if bits else 0
+
+    def favorites(self):
+        self.refresh()
+        if self.numpy:
+            return self.columns["favorite"].copy()
+        return self.flags_mask(self.columns["favorite"])
+
+    def tagged(self, tag):
+        """Rows that carry tag."""
+        self.refresh()
+        tag_id = self.tag_ids.get(tag.strip().lower())
+        if tag_id is None:
+            return self.none()
+        if self.numpy:
+            return np.unpackbits(self.tag_bitmaps[tag_id], count=len(self.images), bitorder="little").view(bool)
+        return self.tag_bitmaps[tag_id]
+
+    def in_groups(self, groups):
+        mask = self.none()
+        for group in groups:
+            group_id = self.group_ids.get(group)
+            if group_id is not None:
+                mask |= self.range_mask(*self.group_ranges[group_id])
+        return mask
+
+    def group_weight_compare(self, op, value):
+        """Rows whose group's weight satisfies op against value."""
+        self.refresh()
+        compare = COMPARISONS[op]
+        if self.numpy:
+            return compare(self.group_weight, value)[self.group_id]
+        return self.in_groups(group for group, weight in zip(self.groups, self.group_weight) if compare(weight, value))
+
+    def range_mask(self, start, end):
+        if self.numpy:
+            mask = self.none()
+            mask[start:end] = True
+            return mask
+        return ((1 << (end - start)) - 1) << start
+
+    def select(self, mask):
+        """The SmartImages of the rows set in mask."""
+        return [self.images[row] for row in self.mask_rows(mask)]
+
+    def query(self, favorite=None, tags=(), any_tags=(), exclude_tags=(), min_weight=None, min_group_weight=None,
+              groups=None):
+        """Return the images matching every given filter, EX: all favorites tagged x in groups weighted over 2.
+
+        tags must all be present, at least one of any_tags must be, and none of exclude_tags may be.
+        """
+        mask = self.all()
+        if favorite is not None:
+            favorites = self.favorites()
+            mask &= favorites if favorite else self.invert(favorites)
+        for tag in tags:
+            mask &= self.tagged(tag)
+        if any_tags:
+            any_mask = self.none()
+            for tag in any_tags:
+                any_mask |= self.tagged(tag)
+            mask &= any_mask
+        for tag in exclude_tags:
+            mask &= self.invert(self.tagged(tag))
+        if min_weight is not None:
+            mask &= self.compare("weight", ">", min_weight)
+        if min_group_weight is not None:
+            mask &= self.group_weight_compare(">", min_group_weight)
+        if groups is not None:
+            mask &= self.in_groups(groups)
+        return self.select(mask)
+
+    # ----------------Updates----------------
+
+    def on_change(self, obj):
+        with self.lock:
+            self.changed.add(obj)
+
+    def refresh(self):
+        """Apply the changes made to images and groups since the last query."""
+        if not self.changed:
+            return
+        with self.lock:
+            changed = list(self.changed)
+            self.changed.clear()
+
+        for obj in changed:
+            if isinstance(obj, Group):
+                group_id = self.group_ids.get(obj)
+                if group_id is not None:
+                    self.group_weight[group_id] = obj.weight
+                continue
+
+            row = self.rows.get(obj)
+            if row is None:
+                continue
+            for name, (_, _, attribute) in COLUMNS.items():
+                self.columns[name][row] = getattr(obj, attribute)
+
+            old_tags = self.row_tags[row]
+            if old_tags != obj.tags:
+                for tag in set(old_tags) - set(obj.tags):
+                    self.set_tag_bit(tag, row, False)
+                for tag in set(obj.tags) - set(old_tags):
+                    self.set_tag_bit(tag, row, True)
+                self.row_tags[row] = obj.tags
+
+    def set_tag_bit(self, tag, row, value):
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            if not value:
+                return
+            tag_id = self.tag_ids[tag] = len(self.tag_ids)
+            if self.numpy:
+                empty = np.zeros((1, (len(self.images) + 7) // 8), dtype="uint8")
+                self.tag_bitmaps = np.vstack([self.tag_bitmaps.reshape(-1, empty.shape[1]), empty])
+            else:
+                self.tag_bitmaps.append(0)
+
+        if self.numpy:
+            bit = np.uint8(1 << (row & 7))
+            if value:
+                self.tag_bitmaps[tag_id, row >> 3] |= bit
+            else:
+                self.tag_bitmaps[tag_id, row >> 3] &= ~bit
+        elif value:
+            self.tag_bitmaps[tag_id] |= 1 << row
+        else:
+            self.tag_bitmaps[tag_id] &= ~(1 << row)
@@ -0,0 +1,150 @@
+import tkinter as tk
+
+# Number of row widgets the navigator creates, whatever the number of groups
+VISIBLE_ROWS = 25
+
+ROW_BG = "gainsboro"
+SELECTED_BG = "lightsteelblue"
+
+
+class GroupNavigator(tk.Frame):
+    """Searchable list of groups that only creates widgets for the rows on screen.
+
+    A fixed pool of labels is reused as the list scrolls, showing whichever groups are in view, so building and
+    updating the navigator costs the same for ten groups as for ten thousand. on_select is called with the group id
+    of a clicked row.
+    """
+
+    def __init__(self, parent, on_select, rows=VISIBLE_ROWS):
+        super().__init__(parent, bg=ROW_BG, relief=tk.GROOVE, padx=5, pady=5)
+        self.on_select = on_select
+
+        # Every group in collection order, and the ones matching the search
+        self.groups = []
+        self.matches = []
+
+        # group id -> position in matches, rebuilt with it
+        self.match_positions = {}
+
+        # Position in matches of the first row on screen
+        self.top = 0
+        self.selected_id = None
+
+        self.search_var = tk.StringVar()
+        self.search_entry = tk.Entry(self, textvariable=self.search_var)
+
+        # Leave out the root window's bind tag, so typing a search doesn't trigger the viewer's keybinds
+        self.search_entry.bindtags((str(self.search_entry), "Entry", "all"))
+        self.search_entry.bind("<Return>", self.select_first_match)
+        self.search_entry.bind("<Escape>", self.clear_search)
+        self.search_var.trace_add("write", self.on_search)
+
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scrollbar, takefocus=0)
+        self.list_frame = tk.Frame(self, bg=ROW_BG)
+        self.rows = []
+        for i in range(rows):
+            row = tk.Label(self.list_frame, anchor=tk.W, bg=ROW_BG, takefocus=0)
+            row.pack(fill=tk.X)
+            row.bind("<Button-1>", lambda event, i=i: self.click(i))
+            row.bind("<MouseWheel>", self.on_mouse_wheel)
+            row.bind("<Button-4>", lambda event: self.scroll(-3))
+            row.bind("<Button-5>", lambda event: self.scroll(3))
+            self.rows.append(row)
+
+        # Rows aren't drawn while the navigator is hidden, showing it draws them
+        self.bind("<Map>", lambda event: self.render())
+
+        self.search_entry.pack(side=tk.TOP, fill=tk.X, pady=(0, 5))
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.list_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    # ----------------Group list----------------
+
+    def set_groups(self, groups):
+        self.groups = list(groups)
+        self.refilter()
+
+    def insert(self, group, index):
+        self.groups.insert(index, group)
+        self.refilter()
+
+    def remove(self, group):
+        self.groups = [g for g in self.groups if g.group_id != group.group_id]
+        self.refilter()
+
+    def clear(self):
+        self.groups = []
+        self.refilter()
+
+    def select(self, group_id):
+        """Highlight the group and scroll it into view, without calling on_select."""
+        self.selected_id = group_id
+        position = self.match_positions.get(group_id)
+        if position is not None and not self.top <= position < self.top + len(self.rows):
+            self.top = position - len(self.rows) // 2
+        self.render()
+
+    # ----------------Search----------------
+
+    def on_search(self, *args):
+        self.top = 0
+        self.refilter()
+
+    def refilter(self):
+        text = self.search_var.get().strip().lower()
+        if text:
+            self.matches = [group for group in self.groups if text in group.name.lower()]
+        else:
+            self.matches = self.groups
+        self.match_positions = {group.group_id: position for position, group in enumerate(self.matches)}
+        self.render()
+
+    def select_first_match(self, event=None):
+        if self.matches:
+            self.on_select(self.matches[0].group_id)
+
+    def clear_search(self, event=None):
+        self.search_var.set("")
+        self.winfo_toplevel().focus_set()
+
+    # ----------------Rendering----------------
+
+    def render(self):
+        """Show the rows from top onwards in the label pool."""
+        self.top = max(0, min(self.top, len(self.matches) - len(self.rows)))
+        if not self.winfo_ismapped():
+            return
+        for i, row in enumerate(self.rows):
+            position = self.top + i
+            if position < len(self.matches):
+                group = self.matches[position]
+                selected = group.group_id == self.selected_id
+                row.configure(text="    " * group.depth + group.name, bg=SELECTED_BG if selected else ROW_BG)
+            else:
+                row.configure(text="", bg=ROW_BG)
+
+        if self.matches:
+            self.scrollbar.set(self.top / len(self.matches), (self.top + len(self.rows)) / len(self.matches))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, rows):
+        self.top += rows
+        self.render()
+
+    def on_mouse_wheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.top = int(float(amount) * len(self.matches))
+            self.render()
+        elif unit == "pages":
+            self.scroll(int(amount) * len(self.rows))
+        else:
+            self.scroll(int(amount))
+
+    def click(self, i):
+        position = self.top + i
+        if position < len(self.matches):
+            self.on_select(self.matches[position].group_id)
@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+
+
+class ImageCache:
+    """Least recently used cache that evicts by the total size of its entries instead of their count."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+
+        # Lookup counters for sizing the cache, only get() counts
+        self.hits = 0
+        self.misses = 0
+
+        # key -> (value, size in bytes), ordered from least to most recently used
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """The value stored under key, counting the lookup as a hit or miss."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """get() without counting, for lookups the user isn't waiting on, EX: prefetching or a render's own steps."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store value under key, evicting the least recently used entries until it fits."""
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.used_bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.used_bytes -= evicted_size
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.used_bytes -= entry[1]
+
+    def remove_where(self, predicate):
+        """Remove every entry whose key satisfies predicate."""
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self.used_bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used_bytes = 0
+
+    def stats(self):
+        """Return the hit/miss counters along with the current usage."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "used_bytes": self.used_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
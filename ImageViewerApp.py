@@ -1,10 +1,36 @@
 import tkinter as tk
 import os
-from tkinter import messagebox, ttk
+from tkinter import messagebox, simpledialog
 from PIL import Image, ImageTk
-from Structures import Collection, GifImage
+from Structures import Collection, GifImage, gif_frame_budget
 from UIManager import UIManager
+from ImageCache import ImageCache
+from Prefetcher import Prefetcher
+from RenderCache import RenderCache
+from RenderWorker import RenderWorker
+from Catalog import Catalog
+from TagIndex import TagIndex
+from RandomDraw import RandomDraw
+from ThumbnailAtlas import ThumbnailAtlas, THUMBNAIL_SIZE, thumbnail_pool
+from ThumbnailGrid import ThumbnailGrid
+import Renderer
 import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Memory allowed for decoded source bitmaps and their scaled versions, shared by every display path
+IMAGE_CACHE_BYTES = 1024 * 1024 * 1024
+
+# How long zoom/pan input has to stop before the fast preview is replaced by a high quality render
+HIGH_QUALITY_DELAY_MS = 150
+
+# Memory allowed for pre-rendered GIF frames that are ready to be swapped into the image label
+GIF_FRAME_CACHE_BYTES = 384 * 1024 * 1024
+
+# In random mode an image isn't drawn again until this many other images have been shown
+RANDOM_NO_REPEAT = 100
+
+# Milliseconds between redraws of the thumbnail grid while its thumbnails are being generated
+THUMBNAIL_POLL_INTERVAL = 150
 
 
 class ImageViewerApp:
@@ -21,9 +47,18 @@ class ImageViewerApp:
         # Attribute for original list of collections for saving purposes:
         self.original_collections = []
 
-        # Structure for keeping track of the image you were looking at when switching groups
+        # Structure for keeping track of the image you were looking at when switching groups, keyed by group id
         self.stored_indices = {}
 
+        # group id -> position of the group in the current collection, rebuilt whenever groups are added or removed
+        self.group_positions = {}
+
+        # Group last shown in the navigator and group details
+        self.navigator_group = None
+
+        # SessionLoader of a session whose groups are still being read, see MainApp.load_session
+        self.session_loader = None
+
         # Indexing attributes
         self.current_collection_index = 0
         self.current_group_index = 0
@@ -47,10 +82,17 @@ class ImageViewerApp:
         self.root.title("Image Viewer")
         self.root.geometry(f'{self.screen_width}x{self.screen_height}')
 
-        # Create and place base image widget
-        self.image_label = tk.Label(self.root, padx=0, pady=0, bg='grey')
+        # Create and place base image widget, images are items on a canvas so that panning only has to move them
+        self.image_canvas = tk.Canvas(self.root, width=self.screen_width, height=self.screen_height, bg='grey',
+                                      highlightthickness=0, takefocus=0)
+        self.canvas_image = self.image_canvas.create_image(0, 0, anchor=tk.NW)
         self.layout_widgets()
 
+        # The image and zoom level the canvas is currently showing, and the size of the shown PhotoImage
+        self.viewport_image = None
+        self.viewport_zoom = None
+        self.viewport_size = (0, 0)
+
         # Layout the more advanced widgets
         self.ui_manager = UIManager(root, self.update_widgets)
 
@@ -75,6 +117,59 @@ class ImageViewerApp:
         self.update_widgets()
 
         self.current_gif = None
+        self.gif_preview = False
+        self.animation = None
+
+        # Pending root.after id of the high quality render that follows a preview, and whether one is needed
+        self.high_quality_job = None
+        self.needs_high_quality = False
+
+        # Pre-rendered GIF frames keyed by (path, view, frame index), and the view each GIF was rendered for
+        self.gif_frame_cache = ImageCache(GIF_FRAME_CACHE_BYTES)
+        self.gif_views = {}
+
+        # Builds the scaled frame set of the current GIF off the Tk thread, and the (key, future) of the last build
+        self.gif_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gif")
+        self.gif_build = None
+
+        # Decoded and scaled bitmaps keyed by path, mtime, zoom and screen size
+        self.image_cache = ImageCache(IMAGE_CACHE_BYTES)
+
+        # Screen-sized renders kept on disk between runs, by this viewer and BatchRender, checked before anything is
+        # decoded. The least recently used are deleted once they pass RENDER_CACHE_BYTES
+        self.render_cache = RenderCache()
+
+        # Renders the image being navigated to off the Tk thread, dropping renders overtaken by later navigation
+        self.render_worker = RenderWorker(self.root)
+
+        # Decodes and scales the neighbouring images of the current group in the background
+        self.prefetcher = Prefetcher(self.image_cache, self.screen_width, self.screen_height,
+                                     disk_cache=self.render_cache)
+
+        # Columnar copy of the open groups' metadata for queries across the library, built on first use
+        self.catalog = None
+
+        # Tag -> images index of the open groups, built by the first tag query and kept current by the tag methods
+        self.tag_index = None
+
+        # Random mode draws the next image by image weight x group weight, previous image walks back the history
+        self.random_mode = False
+        self.random_draw = None
+        self.random_history = []
+
+        # Thumbnail atlas of each collection keyed by its base folder, opened when the grid first shows the collection
+        self.thumbnail_atlases = {}
+
+        # Grid of the current group's thumbnails, shown over the image. Missing thumbnails are generated by worker
+        # processes, driven from a single thread, and generation restarts whenever the grid shows another group. The
+        # processes are started on first use and kept for every later run
+        self.thumbnail_grid = ThumbnailGrid(self.root, self.on_thumbnail_selected, THUMBNAIL_SIZE)
+        self.thumbnail_grid_shown = False
+        self.thumbnail_group = None
+        self.thumbnail_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+        self.thumbnail_processes = None
+        self.thumbnail_job = None
+        self.thumbnail_generation = 0
 
     def load_collections(self, folder_path=None, whitelist=None, blacklist=None, collections=None):
         if collections is None:
@@ -95,15 +190,17 @@ class ImageViewerApp:
 
         # Store the original collections as a copy of the current collections
         self.original_collections = self.collections.copy()
+        self.invalidate_indexes()
 
         if self.collections:
             self.display_current_image()
 
     def layout_widgets(self):
-        self.image_label.pack()
+        self.image_canvas.pack()
 
     def update_widgets(self, mode=None, tags=None, start=None, end=None, zoom_level=None, panx=None, pany=None,
-                       default=None, preconfig=None, group_weight=None, group_favorite=None, new_duration=None):
+                       default=None, preconfig=None, group_weight=None, group_favorite=None, new_duration=None,
+                       group_id=None):
         if mode == "add_group":
             self.add_tags_to_group(tags)
         elif mode == "add_range":
@@ -128,6 +225,8 @@ class ImageViewerApp:
             if self.current_gif:
                 self.current_gif.set_all_frame_durations(new_duration)
                 self.ui_manager.update_gif_frame_durations(self.current_gif.durations)
+        elif mode == "select_group":
+            self.on_group_selected(group_id)
 
         if not self.notebook and self.collections:
             # Ensure that empty groups are not added to the list
@@ -135,16 +234,18 @@ class ImageViewerApp:
 
             # Create the notebook if it hasn't been already
             self.ui_manager.create_notebook(self.collections[self.current_collection_index].groups)
+            self.reindex_groups()
 
             # Set created boolean to true so this code doesn't run again
             self.notebook = True
         if self.collections:
             current_group = self.collections[self.current_collection_index].groups[self.current_group_index]
-            current_group_name = current_group.name
 
-            self.ui_manager.update_notebook(current_group_name)
-            self.ui_manager.update_group_details(
-                self.collections[self.current_collection_index].groups[self.current_group_index])
+            # Flipping images within a group leaves the navigator and group details as they are
+            if current_group is not self.navigator_group or mode is not None:
+                self.navigator_group = current_group
+                self.ui_manager.update_notebook(current_group)
+                self.ui_manager.update_group_details(current_group)
 
     def initialize_keybinds(self):
 
@@ -177,6 +278,7 @@ class ImageViewerApp:
         self.root.bind('<Control-d>', self.toggle_dialogs)
         self.root.bind('<Control-f>', self.toggle_favorite)
         self.root.bind('<Control-m>', self.toggle_wrap)
+        self.root.bind('<Control-e>', self.toggle_random_mode)
 
         # Group management
         self.root.bind('<Control-w>', self.close_group)
@@ -198,9 +300,10 @@ class ImageViewerApp:
 
         # Collection management
         self.root.bind('<Control-Shift-C>', self.combine_collections)
+        self.root.bind('<Control-q>', self.open_tag_query)
+        self.root.bind('<Control-g>', self.toggle_thumbnail_grid)
 
-        # Notebook/tab binding
-        self.ui_manager.notebook.bind("<<NotebookTabChanged>>", self.on_tab_change)
+        # Group navigator
         self.root.bind('<Control-k>', self.refresh_notebook)
 
         # Testing
@@ -209,6 +312,7 @@ class ImageViewerApp:
         self.root.bind('<Control-m>', self.display_current_image)
         self.root.bind('<Control-x>', self.decrease_animation_speed)
         self.root.bind('<Control-f>', self.update_widgets)
+        self.root.bind('<Control-i>', self.print_cache_stats)
 
         # Locked
         self.root.bind('<Control-a>', self.lock_keybind)
@@ -217,150 +321,258 @@ class ImageViewerApp:
         # Method for deleting empty groups
         for collection in self.collections:
             for group in collection.groups[:]:
-                if not group.images:
+                # Groups of a loading session are empty until they are read
+                if not group.images and not (self.session_loader and self.session_loader.is_pending(group)):
                     collection.groups.remove(group)
+        self.invalidate_indexes()
+        self.reindex_groups()
 
     def lock_keybind(self, event=None):
         return
 
     # ----------------Display Methods----------------
 
-    def display_image(self, smart_image):
-        # Open the image using the path from the SmartImage object
+    def display_image(self, smart_image, preview=False):
+        # A GIF that was on screen would otherwise keep painting its frames over this image
+        self.stop_gif_animation()
 
-        image = Image.open(smart_image.path)
-
-        # Retrieve zoom level, panx, and pany from the SmartImage object
         zoom_level = smart_image.zoom_level
-        panx = smart_image.panx
-        pany = smart_image.pany
 
-        # Calculate the scaling factor to maintain the aspect ratio
-        screen_ratio = self.screen_width / self.screen_height
-        image_ratio = image.width / image.height
+        # A render that is already in memory, EX: prefetched or revisited, is shown straight away. Anything else is
+        # rendered by the render worker and shown when it is done, unless another image was asked for in the meantime
+        image = Renderer.cached_scaled(self.image_cache, smart_image.path, self.screen_width, self.screen_height,
+                                       zoom_level)
+        if image is not None:
+            self.render_worker.cancel()
+            self.show_render(smart_image, zoom_level, image)
+            return
 
-        if image_ratio > screen_ratio:
-            # Image is wider relative to screen
-            scale_factor = self.screen_width / image.width
+        if preview:
+            # Quick resample while the user is zooming, replaced by a high quality render once the input stops
+            self.needs_high_quality = True
+            self.render_worker.submit(
+                lambda: Renderer.load_preview(self.image_cache, smart_image.path, self.screen_width,
+                                              self.screen_height, zoom_level, disk_cache=self.render_cache)[0],
+                lambda result: self.show_render(smart_image, zoom_level, result))
         else:
-            # Image is taller relative to screen
-            scale_factor = self.screen_height / image.height
-
-        # Calculate new dimensions with zoom level
-        new_width = int(image.width * scale_factor * zoom_level)
-        new_height = int(image.height * scale_factor * zoom_level)
-
-        # Resize the image maintaining the aspect ratio
-        image = image.resize((new_width, new_height), Image.LANCZOS)
-
-        # Create a new blank image with the same size as the screen to apply pan
-        result_image = Image.new("RGBA", (self.screen_width, self.screen_height), (0, 0, 0, 0))
-
-        # Calculate the position to paste the image onto the blank image
-        paste_x = (self.screen_width - new_width) // 2 + panx
-        paste_y = (self.screen_height - new_height) // 2 + pany
-
-        # Paste the resized image onto the blank image
-        result_image.paste(image, (paste_x, paste_y))
+            # Scale the image with its zoom level, the cache covers prefetched images, revisits and pans. Renders at
+            # the default zoom are also kept on disk, most images are opened at it every run
+            persist = zoom_level == smart_image.default_zoom_level
+            self.render_worker.submit(
+                lambda: Renderer.load_scaled(self.image_cache, smart_image.path, self.screen_width,
+                                             self.screen_height, zoom_level, self.render_cache, persist),
+                lambda result: self.show_render(smart_image, zoom_level, result))
+
+    def show_render(self, smart_image, zoom_level, image):
+        """Show a finished render of smart_image at zoom_level, on the Tk thread."""
+        # Convert the scaled image to a PhotoImage, the pan is applied by where it is placed on the canvas
+        img = ImageTk.PhotoImage(image)
+        self.show_in_viewport(img, smart_image, zoom_level)
+
+    def show_in_viewport(self, img, smart_image, zoom_level=None):
+        """Show a scaled PhotoImage of smart_image, rendered at zoom_level, on the canvas at its current pan."""
+        self.image_canvas.itemconfig(self.canvas_image, image=img)
+
+        # Anti-Garbage collection line
+        self.image_canvas.image = img
+
+        self.viewport_image = smart_image
+        self.viewport_zoom = smart_image.zoom_level if zoom_level is None else zoom_level
+        self.viewport_size = (img.width(), img.height())
+        self.move_viewport(smart_image.panx, smart_image.pany)
+
+    def move_viewport(self, panx, pany):
+        x, y = Renderer.paste_position(*self.viewport_size, self.screen_width, self.screen_height, panx, pany)
+        self.image_canvas.coords(self.canvas_image, x, y)
+
+    def pan_current_image(self, current_image):
+        """Apply a pan change by moving what is already on screen, only re-rendering if it shows something else."""
+        if self.viewport_image is current_image and self.viewport_zoom == current_image.zoom_level:
+            self.move_viewport(current_image.panx, current_image.pany)
+            self.ui_manager.update_image_details(current_image)
+        else:
+            self.display_current_image()
 
-        # Convert the final image to a PhotoImage for displaying in the label
-        img = ImageTk.PhotoImage(result_image)
-        self.image_label.config(image=img)
-        self.image_label.image = img
+    def display_current_image(self, event=None, preview=False):
 
-    def display_current_image(self, event=None):
+        # A full render makes any pending high quality render from an earlier preview redundant
+        if not preview and self.high_quality_job is not None:
+            self.root.after_cancel(self.high_quality_job)
+            self.high_quality_job = None
+            self.needs_high_quality = False
 
         current_collection = self.collections[self.current_collection_index]
         current_group = current_collection.groups[self.current_group_index]
 
+        # Groups of a session that is still loading are read on demand if they are reached before the background load
+        if self.session_loader is not None:
+            self.session_loader.hydrate(current_group)
+
         if self.current_image_index < len(current_group.images):
             smart_image = current_group.images[self.current_image_index]
 
+            # The scaled frames of a GIF are only kept while it is on screen
+            if self.current_gif is not None and self.current_gif is not smart_image:
+                self.current_gif.release_derived_frames()
+
             if isinstance(smart_image, GifImage):
-                self.display_gif(smart_image)
+                self.display_gif(smart_image, preview)
             else:
                 print("Detected regular image, calling display_image method")
-                self.display_image(smart_image)
+                self.display_image(smart_image, preview)
 
             self.ui_manager.update_image_details(smart_image)
+
+            # Get the neighbouring images ready while this one is being looked at
+            if not preview:
+                self.prefetcher.prefetch(current_group.images, self.current_image_index, self.image_wrap)
+                self.update_thumbnail_grid()
         else:
             print(
                 f"Image index {self.current_image_index} is out of range for group '{current_group.name}' "
                 f"with {len(current_group.images)} images")
 
-    def display_gif(self, gif_image):
-        """Play the GIF image."""
+    def display_current_image_progressive(self):
+        """Show a fast preview now and a single high quality render once zoom/pan input stops."""
+        self.display_current_image(preview=True)
+
+        # Every key repeat pushes the high quality render back, so a held key only ends in one of them
+        if self.high_quality_job is not None:
+            self.root.after_cancel(self.high_quality_job)
+            self.high_quality_job = None
+        if self.needs_high_quality:
+            self.high_quality_job = self.root.after(HIGH_QUALITY_DELAY_MS, self.display_high_quality)
+
+    def display_high_quality(self):
+        self.high_quality_job = None
+        self.needs_high_quality = False
+        self.display_current_image()
+
+    def display_gif(self, gif_image, preview=False):
+        """Play the GIF image, decoding its frames on the render worker first if they aren't in memory."""
+        # Only one frame loop may be scheduled at a time, redisplaying would otherwise start a second one
+        if self.animation is not None:
+            self.root.after_cancel(self.animation)
+            self.animation = None
+
+        if gif_image.frames:
+            # A still image that is still being rendered would otherwise replace the GIF once it is done
+            self.render_worker.cancel()
+            gif_frame_budget.pin(gif_image)
+            self.play_gif(gif_image, preview)
+            return
+
+        # Decoding every frame of a large GIF is the slowest load there is, so it goes through the render worker like
+        # a still image and is dropped if another image is asked for before it is done. The GIF that was playing is
+        # stopped, its frames would otherwise stay on screen as if they were this one's
+        self.stop_gif_animation()
+        gif_frame_budget.pin(gif_image)
+        self.render_worker.submit(gif_image.load_gif_frames, lambda frames: self.play_gif(gif_image, preview))
+
+    def play_gif(self, gif_image, preview):
+        """Start the frame loop of a GIF whose frames are decoded, on the Tk thread."""
+        # Frame builds for other GIFs on the GIF worker may enforce the budget, they must not release this one
+        gif_frame_budget.pin(gif_image)
+
         self.current_gif = gif_image
+        self.gif_preview = preview
+        if preview:
+            self.needs_high_quality = True
+
+        # Frames are kept until the GIF frame budget releases them, this marks them as recently used
+        with self.lock:
+            self.current_gif.load_gif_frames()
+            if self.current_gif.current_frame >= len(self.current_gif.frames):
+                self.current_gif.current_frame = 0
 
         # Make is_animated attribute be true
         self.current_gif.play()
 
         self.update_gif_frame()
 
+    def stop_gif_animation(self):
+        """Cancel the frame loop of the GIF on screen, if any, and forget it."""
+        if self.animation is not None:
+            self.root.after_cancel(self.animation)
+            self.animation = None
+        with self.lock:
+            if self.current_gif and self.current_gif.is_animated:
+                self.current_gif.stop()
+            self.current_gif = None
+        gif_frame_budget.pin(None)
+
     def update_gif_frame(self):
         """Update the frame of the GIF."""
         with self.lock:
             if not self.current_gif or not self.current_gif.frames or not self.current_gif.is_animated:
                 return
 
-            # Image for getting dimensions
-            frame = self.current_gif.frames[self.current_gif.current_frame]
-            image = ImageTk.PhotoImage(frame)
-
-            # Retrieve zoom level, panx, and pany from the GifImage object
-            zoom_level = self.current_gif.zoom_level
-            panx = self.current_gif.panx
-            pany = self.current_gif.pany
-
-            # Calculate the scaling factor to maintain the aspect ratio
-            screen_ratio = self.screen_width / self.screen_height
-            image_ratio = image.width() / image.height()
-
-            if image_ratio > screen_ratio:
-                # Image is wider relative to screen
-                scale_factor = self.screen_width / image.width()
-            else:
-                # Image is taller relative to screen
-                scale_factor = self.screen_height / image.height()
-
-            # Calculate new dimensions with zoom level
-            new_width = int(image.width() * scale_factor * zoom_level)
-            new_height = int(image.height() * scale_factor * zoom_level)
+            gif = self.current_gif
+            frame_index = gif.current_frame % len(gif.frames)
 
-            # Resize the image maintaining the aspect ratio
-            frame = frame.resize((new_width, new_height), Image.LANCZOS)
+            # Use the derived frame set for this zoom level once it is built, until then frames are scaled one at a
+            # time with a quick filter. Building it is left until zooming stops
+            frames = gif.get_derived_frames(gif.zoom_level, self.screen_width, self.screen_height)
+            if frames is None and not self.gif_preview:
+                self.build_derived_frames(gif)
 
-            # Create a new blank image with the same size as the screen to apply pan
-            result_image = Image.new("RGBA", (self.screen_width, self.screen_height), (0, 0, 0, 0))
+            # Frames are rendered once per view, the pan is applied by the viewport
+            view = (gif.zoom_level, self.screen_width, self.screen_height, frames is not None)
+            if self.gif_views.get(gif.path) != view:
+                self.gif_frame_cache.remove_where(lambda key: key[0] == gif.path)
+                self.gif_views[gif.path] = view
 
-            # Calculate the position to paste the image onto the blank image
-            paste_x = (self.screen_width - new_width) // 2 + panx
-            paste_y = (self.screen_height - new_height) // 2 + pany
-
-            # Paste the resized image onto the blank image
-            result_image.paste(frame, (paste_x, paste_y))
-
-            # Convert the final image to a PhotoImage for displaying in the label
-            img = ImageTk.PhotoImage(result_image)
-
-            # Anti-Garbage collection line
-            self.image_label.image = img
+            key = (gif.path, view, frame_index)
+            img = self.gif_frame_cache.get(key)
+            if img is None:
+                img = self.render_gif_frame(gif, frame_index, frames)
+                self.gif_frame_cache.put(key, img, img.width() * img.height() * 4)
 
             if self.current_gif.is_animated and not self.current_gif.is_paused:
-                self.image_label.config(image=img)
-                self.current_gif.current_frame = (self.current_gif.current_frame + 1) % len(self.current_gif.frames)
+                self.show_in_viewport(img, gif)
+                self.current_gif.current_frame = (frame_index + 1) % len(self.current_gif.frames)
 
                 # Schedule the next frame update with the correct duration
                 next_duration = self.current_gif.get_next_frame_duration()
                 self.animation = self.root.after(next_duration, self.update_gif_frame)
             elif self.current_gif.is_animated and self.current_gif.is_paused:
-                self.image_label.config(image=img)
+                self.show_in_viewport(img, gif)
+
+    def render_gif_frame(self, gif, frame_index, frames=None):
+        """Convert a single GIF frame to a PhotoImage, taking it from the derived frame set when there is one."""
+        if frames is not None and frame_index < len(frames):
+            frame = frames[frame_index]
+        else:
+            frame = Renderer.scale_image(gif.frames[frame_index], self.screen_width, self.screen_height,
+                                         gif.zoom_level, Image.BILINEAR)
+        return ImageTk.PhotoImage(frame)
+
+    def build_derived_frames(self, gif):
+        """Scale all frames of gif for its current zoom level on the GIF worker."""
+        key = (gif, gif.zoom_level)
+        if self.gif_build is not None:
+            if self.gif_build[0] == key and not self.gif_build[1].done():
+                return
+            # A build for a zoom level that was left before it started is no use anymore
+            self.gif_build[1].cancel()
+
+        future = self.gif_worker.submit(gif.resize_frames, gif.zoom_level, self.screen_width, self.screen_height)
+        future.add_done_callback(self.report_gif_build_error)
+        self.gif_build = (key, future)
+
+    def report_gif_build_error(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Error building GIF frames: {future.exception()}")
 
     def decrease_animation_speed(self, event=None):
         print("AAA")
-        self.current_gif.increase_frame_durations(100)
+        if self.current_gif:
+            self.current_gif.increase_frame_durations(100)
 
     def next_image(self, event=None):
+        if self.random_mode:
+            self.next_random_image()
+            return
 
         with self.lock:
             # Prevent any current gif from cycling
@@ -384,6 +596,9 @@ class ImageViewerApp:
         self.display_current_image()
 
     def previous_image(self, event=None):
+        if self.random_mode and self.random_history:
+            self.previous_random_image()
+            return
 
         with self.lock:
             # Prevent any current gif from cycling
@@ -417,8 +632,11 @@ class ImageViewerApp:
         # Access the current group
         current_group = current_collection.groups[self.current_group_index]
 
+        # Whatever was being prefetched belongs to the group being left
+        self.prefetcher.cancel()
+
         # Store the current index of the group being swapped from
-        self.stored_indices.update({current_group.name: self.current_image_index})
+        self.stored_indices.update({current_group.group_id: self.current_image_index})
 
         self.current_group_index += 1
 
@@ -428,8 +646,8 @@ class ImageViewerApp:
             self.current_group_index = 0
 
         # Check to see if the new group has a stored index, and if so, set current index to such
-        if current_collection.groups[self.current_group_index].name in self.stored_indices:
-            self.current_image_index = self.stored_indices[current_collection.groups[self.current_group_index].name]
+        if current_collection.groups[self.current_group_index].group_id in self.stored_indices:
+            self.current_image_index = self.stored_indices[current_collection.groups[self.current_group_index].group_id]
         else:
             self.current_image_index = 0
 
@@ -450,8 +668,11 @@ class ImageViewerApp:
         # Access the current group
         current_group = current_collection.groups[self.current_group_index]
 
+        # Whatever was being prefetched belongs to the group being left
+        self.prefetcher.cancel()
+
         # Store the current index of the group being swapped from
-        self.stored_indices.update({current_group.name: self.current_image_index})
+        self.stored_indices.update({current_group.group_id: self.current_image_index})
 
         self.current_group_index -= 1
 
@@ -461,8 +682,8 @@ class ImageViewerApp:
             self.current_group_index = len(current_collection.groups) - 1
 
         # Check to see if the new group has a stored index, and if so, set current index to such
-        if current_collection.groups[self.current_group_index].name in self.stored_indices:
-            self.current_image_index = self.stored_indices[current_collection.groups[self.current_group_index].name]
+        if current_collection.groups[self.current_group_index].group_id in self.stored_indices:
+            self.current_image_index = self.stored_indices[current_collection.groups[self.current_group_index].group_id]
         else:
             self.current_image_index = 0
 
@@ -475,6 +696,53 @@ class ImageViewerApp:
     def toggle_wrap(self, event=None):
         self.image_wrap = not self.image_wrap
 
+    def toggle_random_mode(self, event=None):
+        self.random_mode = not self.random_mode
+        self.random_history = []
+        print(f"Random mode {'on' if self.random_mode else 'off'}")
+
+    def get_random_draw(self):
+        if self.random_draw is None:
+            groups = self.collections[self.current_collection_index].groups
+            self.random_draw = RandomDraw(groups, no_repeat=RANDOM_NO_REPEAT)
+        return self.random_draw
+
+    def next_random_image(self):
+        drawn = self.get_random_draw().draw()
+        if drawn is None:
+            print("Every image has a weight of 0, nothing to draw")
+            return
+        current_group = self.collections[self.current_collection_index].groups[self.current_group_index]
+        self.random_history.append((current_group, self.current_image_index))
+        self.show_position(*drawn)
+
+    def previous_random_image(self):
+        group, image_index = self.random_history.pop()
+        self.show_position(group, image_index)
+
+    def show_position(self, group, image_index):
+        """Show image_index of group, switching groups the way next_group does if needed."""
+        current_collection = self.collections[self.current_collection_index]
+        group_index = self.group_position(group)
+        if group_index is None:
+            # Closed since it was drawn
+            return
+
+        with self.lock:
+            if self.current_gif and self.current_gif.is_animated:
+                self.current_gif.stop()
+
+        if group_index != self.current_group_index:
+            self.prefetcher.cancel()
+            current_group = current_collection.groups[self.current_group_index]
+            self.stored_indices.update({current_group.group_id: self.current_image_index})
+            self.current_group_index = group_index
+            self.current_image_index = image_index
+            self.update_widgets()
+        else:
+            self.current_image_index = image_index
+        self.display_current_image()
+
     def close_group(self, event=None):
         # removes the current tab if it is able to
         with self.lock:
@@ -486,16 +754,21 @@ class ImageViewerApp:
                 current_group = current_collection.groups[self.current_group_index]
 
                 # Store the current index of the group being swapped from
-                self.stored_indices.update({current_group.name: self.current_image_index})
+                self.stored_indices.update({current_group.group_id: self.current_image_index})
                 print(f"Stored index for group '{current_group.name}': {self.current_image_index}")
 
+                # Whatever was being prefetched belongs to the group being closed
+                self.prefetcher.cancel()
+
                 # Store the current group and its index
                 self.closed_groups.append((current_group, self.current_group_index))
                 print(f"Closed group '{current_group.name}' at index {self.current_group_index}")
 
                 # Remove from collections list and notebook
                 self.collections[self.current_collection_index].groups.remove(current_group)
-                self.ui_manager.remove_notebook_tab(self.current_group_index)
+                self.invalidate_indexes()
+                self.reindex_groups()
+                self.ui_manager.remove_notebook_tab(current_group)
                 print(f"Removed group '{current_group.name}' from collection")
 
                 # Decide whether to increment or decrement current group
@@ -505,9 +778,9 @@ class ImageViewerApp:
                     self.current_group_index += 1
 
                 # Check to see if the new group has a stored index, and if so, set current index to such
-                if current_collection.groups[self.current_group_index].name in self.stored_indices:
+                if current_collection.groups[self.current_group_index].group_id in self.stored_indices:
                     self.current_image_index = self.stored_indices[
-                        current_collection.groups[self.current_group_index].name]
+                        current_collection.groups[self.current_group_index].group_id]
                     print(
                         f"Restored index for group '{current_collection.groups[self.current_group_index].name}': {self.current_image_index}")
                 else:
@@ -525,6 +798,8 @@ class ImageViewerApp:
             if self.current_gif and self.current_gif.is_animated:
                 self.current_gif.stop()
 
+            self.prefetcher.cancel()
+
             info = self.closed_groups.pop()
             index = info[1]
             group = info[0]
@@ -532,16 +807,18 @@ class ImageViewerApp:
 
             # Insert the group at its previous index
             self.collections[self.current_collection_index].groups.insert(index, group)
+            self.invalidate_indexes()
+            self.reindex_groups()
             print(f"Inserted group '{group.name}' back into collection at index {index}")
 
             # Recreate the notebook tab
-            self.ui_manager.add_notebook_tab(group.name, index)
+            self.ui_manager.add_notebook_tab(group, index)
             print(f"Recreated notebook tab for group '{group.name}' at index {index}")
 
             self.update_widgets()
 
-            if group.name in self.stored_indices:
-                self.current_image_index = self.stored_indices[group.name]
+            if group.group_id in self.stored_indices:
+                self.current_image_index = self.stored_indices[group.group_id]
                 print(f"Restored index for group '{group.name}': {self.current_image_index}")
             else:
                 self.current_image_index = 0
@@ -571,50 +848,38 @@ class ImageViewerApp:
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
         current_image.zoom_level += 0.01  # Increase zoom level
-        if isinstance(current_image, GifImage):
-            current_image.resize_frames()  # Resize GIF frames
-        self.display_current_image()
+        self.display_current_image_progressive()
 
     def zoom_out(self, event=None):
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
         if current_image.zoom_level > 0.01:
             current_image.zoom_level -= 0.01  # Decrease zoom level
-            if isinstance(current_image, GifImage):
-                current_image.resize_frames()  # Resize GIF frames
-        self.display_current_image()
+        self.display_current_image_progressive()
 
     def pan_left(self, event=None):
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
         current_image.panx -= 5
-        if isinstance(current_image, GifImage):
-            current_image.resize_frames()
-        self.display_current_image()
+        self.pan_current_image(current_image)
 
     def pan_right(self, event=None):
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
         current_image.panx += 5
-        if isinstance(current_image, GifImage):
-            current_image.resize_frames()
-        self.display_current_image()
+        self.pan_current_image(current_image)
 
     def pan_up(self, event=None):
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
         current_image.pany -= 5
-        if isinstance(current_image, GifImage):
-            current_image.resize_frames()
-        self.display_current_image()
+        self.pan_current_image(current_image)
 
     def pan_down(self, event=None):
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
         current_image.pany += 5
-        if isinstance(current_image, GifImage):
-            current_image.resize_frames()
-        self.display_current_image()
+        self.pan_current_image(current_image)
 
     def apply_zoom_pan_to_group(self, zoom_level, panx, pany, default, preconfig):
         current_group = self.collections[self.current_collection_index].groups[self.current_group_index]
@@ -623,17 +888,10 @@ class ImageViewerApp:
             image.panx = panx
             image.pany = pany
             if default:
-                image.default_zoom_level = zoom_level
-                image.default_panx = panx
-                image.default_pany = pany
+                image.set_zoom_level(zoom_level)
+                image.set_pan(panx, pany)
             if preconfig:
-                if not hasattr(image, 'preconfig') or len(image.preconfig) < 3:
-                    image.preconfig = [0, 0, 1.0]
-                image.preconfig[0] = panx
-                image.preconfig[1] = pany
-                image.preconfig[2] = zoom_level
-            if isinstance(image, GifImage):
-                image.resize_frames()  # Resize GIF frames
+                image.set_preconfig(panx, pany, zoom_level)
         self.display_current_image()
 
     def apply_zoom_pan_to_current(self, zoom_level, panx, pany, default, preconfig):
@@ -643,17 +901,10 @@ class ImageViewerApp:
         current_image.panx = panx
         current_image.pany = pany
         if default:
-            current_image.default_zoom_level = zoom_level
-            current_image.default_panx = panx
-            current_image.default_pany = pany
+            current_image.set_zoom_level(zoom_level)
+            current_image.set_pan(panx, pany)
         if preconfig:
-            if not hasattr(current_image, 'preconfig') or len(current_image.preconfig) < 3:
-                current_image.preconfig = [0, 0, 1.0]
-            current_image.preconfig[0] = panx
-            current_image.preconfig[1] = pany
-            current_image.preconfig[2] = zoom_level
-        if isinstance(current_image, GifImage):
-            current_image.resize_frames()  # Resize GIF frames
+            current_image.set_preconfig(panx, pany, zoom_level)
         self.display_current_image()
 
     def apply_zoom_pan_to_range(self, zoom_level, panx, pany, start, end, default, preconfig):
@@ -667,17 +918,10 @@ class ImageViewerApp:
             image.panx = panx
             image.pany = pany
             if default:
-                image.default_zoom_level = zoom_level
-                image.default_panx = panx
-                image.default_pany = pany
+                image.set_zoom_level(zoom_level)
+                image.set_pan(panx, pany)
             if preconfig:
-                if not hasattr(image, 'preconfig') or len(image.preconfig) < 3:
-                    image.preconfig = [0, 0, 1.0]
-                image.preconfig[0] = panx
-                image.preconfig[1] = pany
-                image.preconfig[2] = zoom_level
-            if isinstance(image, GifImage):
-                image.resize_frames()  # Resize GIF frames
+                image.set_preconfig(panx, pany, zoom_level)
         self.display_current_image()
 
     # ----------------Configuration Management Methods----------------
@@ -726,15 +970,13 @@ class ImageViewerApp:
                                                       f"\n Pan x: {current_image.panx} "
                                                       f"Pan y: {current_image.pany} Zoom: {current_image.zoom_level}")
             if response:
-                current_image.default_panx = current_image.panx
-                current_image.default_pany = current_image.pany
-                current_image.default_zoom_level = current_image.zoom_level
+                current_image.set_pan(current_image.panx, current_image.pany)
+                current_image.set_zoom_level(current_image.zoom_level)
             else:
                 return
         else:
-            current_image.default_panx = current_image.panx
-            current_image.default_pany = current_image.pany
-            current_image.default_zoom_level = current_image.zoom_level
+            current_image.set_pan(current_image.panx, current_image.pany)
+            current_image.set_zoom_level(current_image.zoom_level)
 
     def save_configuration(self, event=None):
         print("save_configuration called")
@@ -742,10 +984,6 @@ class ImageViewerApp:
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
 
-        # Ensure the preconfig list is initialized and has at least 3 elements
-        if not hasattr(current_image, 'preconfig') or len(current_image.preconfig) < 3:
-            current_image.preconfig = [0, 0, 1.0]
-
         if self.show_dialogs:
             response = messagebox.askokcancel(title="Confirm", message="Are you sure you want to save these "
                                                                        "parameters as a pre-configuration? "
@@ -754,15 +992,11 @@ class ImageViewerApp:
                                                                        f"Zoom: {current_image.zoom_level}")
             if response:
 
-                current_image.preconfig[0] = current_image.panx
-                current_image.preconfig[1] = current_image.pany
-                current_image.preconfig[2] = current_image.zoom_level
+                current_image.set_preconfig(current_image.panx, current_image.pany, current_image.zoom_level)
             else:
                 return
         else:
-            current_image.preconfig[0] = current_image.panx
-            current_image.preconfig[1] = current_image.pany
-            current_image.preconfig[2] = current_image.zoom_level
+            current_image.set_preconfig(current_image.panx, current_image.pany, current_image.zoom_level)
 
     def load_configuration(self, event=None):
         print("save_configuration called")
@@ -797,21 +1031,26 @@ class ImageViewerApp:
                                           message="Are you sure you want to reset this image to default default?"
                                                   f"\n Pan x: 0 Pan y: 0 Zoom:1.0")
         if response:
-            current_image.default_panx = 0
-            current_image.default_pany = 0
-            current_image.default_zoom_level = 1.0
+            current_image.set_pan(0, 0)
+            current_image.set_zoom_level(1.0)
         else:
             return
 
     # ----------------UI Methods----------------
 
-    def on_tab_change(self, event):
+    def on_group_selected(self, group_id):
+        # A group was picked in the navigator, its id maps straight to a position
+        position = self.group_positions.get(group_id)
+        if position is None or position == self.current_group_index:
+            self.root.focus_set()
+            return
 
         with self.lock:
             if self.current_gif and self.current_gif.is_animated:
                 self.current_gif.stop()
-        # Notebook/tab change method
-        selected_tab = event.widget.tab(event.widget.select(), "text")
+
+        # Whatever was being prefetched belongs to the group being left
+        self.prefetcher.cancel()
 
         # Access the current collection
         current_collection = self.collections[self.current_collection_index]
@@ -819,14 +1058,13 @@ class ImageViewerApp:
         current_group = current_collection.groups[self.current_group_index]
 
         # Store the current index of the group being swapped from
-        self.stored_indices.update({current_group.name: self.current_image_index})
+        self.stored_indices.update({current_group.group_id: self.current_image_index})
 
-        for i, group in enumerate(self.collections[self.current_collection_index].groups):
-            if group.name == selected_tab:
-                self.current_group_index = i
-                self.display_current_image()
-                self.root.focus_set()
-                break
+        self.current_group_index = position
+        self.current_image_index = self.stored_indices.get(group_id, 0)
+        self.update_widgets()
+        self.display_current_image()
+        self.root.focus_set()
 
     def toggle_keybinds_and_tag_menu(self, event=None):
         self.toggle_keybinds()
@@ -875,22 +1113,15 @@ class ImageViewerApp:
         self.typing = not self.typing
 
     def refresh_notebook(self, event=None):
-        # Clear the current tabs
-        for tab in self.ui_manager.notebook.tabs():
-            self.ui_manager.notebook.forget(tab)
-
         # Add new tabs for each group in the combined collection
         current_collection = self.collections[0]  # Assuming collections are combined in the first index
-        for group in current_collection.groups:
-            frame = ttk.Frame(self.ui_manager.notebook)
-            self.ui_manager.notebook.add(frame, text=group.name)
+        self.ui_manager.clear_notebook()
+        self.ui_manager.create_notebook(current_collection.groups)
+        self.reindex_groups()
 
         # Select the first tab
         if current_collection.groups:
-            self.ui_manager.notebook.select(0)
-
-        # Update the UI manager's current group index
-        self.ui_manager.update_notebook(current_collection.groups[0].name)
+            self.ui_manager.update_notebook(current_collection.groups[0])
 
     # ----------------Tag Management ----------------
 
@@ -900,7 +1131,7 @@ class ImageViewerApp:
     def add_tags_to_group(self, tags):
         current_group = self.collections[self.current_collection_index].groups[self.current_group_index]
         for image in current_group.images:
-            image.add_tag(tags)
+            self.update_tag_index(image, added=image.add_tag(tags))
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
         self.ui_manager.update_image_details(current_image)
@@ -910,7 +1141,8 @@ class ImageViewerApp:
         current_index = self.current_image_index
 
         for i in range(max(0, current_index + start), min(len(current_group.images), current_index + end + 1)):
-            current_group.images[i].add_tag(tags)
+            image = current_group.images[i]
+            self.update_tag_index(image, added=image.add_tag(tags))
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
         self.ui_manager.update_image_details(current_image)
@@ -919,13 +1151,13 @@ class ImageViewerApp:
 
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
-        current_image.add_tag(tags)
+        self.update_tag_index(current_image, added=current_image.add_tag(tags))
         self.ui_manager.update_image_details(current_image)
 
     def remove_tags_from_group(self, tags):
         current_group = self.collections[self.current_collection_index].groups[self.current_group_index]
         for image in current_group.images:
-            image.remove_tag(tags)
+            self.update_tag_index(image, removed=image.remove_tag(tags))
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
         self.ui_manager.update_image_details(current_image)
@@ -935,7 +1167,8 @@ class ImageViewerApp:
         current_index = self.current_image_index
 
         for i in range(max(0, current_index + start), min(len(current_group.images), current_index + end + 1)):
-            current_group.images[i].remove_tag(tags)
+            image = current_group.images[i]
+            self.update_tag_index(image, removed=image.remove_tag(tags))
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
         self.ui_manager.update_image_details(current_image)
@@ -943,13 +1176,13 @@ class ImageViewerApp:
     def remove_tags_from_current(self, tags):
         current_image = self.collections[self.current_collection_index].groups[self.current_group_index].images[
             self.current_image_index]
-        current_image.remove_tag(tags)
+        self.update_tag_index(current_image, removed=current_image.remove_tag(tags))
         self.ui_manager.update_image_details(current_image)
 
     def update_group_details(self, group_weight, group_favorite):
         current_group = self.collections[self.current_collection_index].groups[self.current_group_index]
-        current_group.weight = group_weight
-        current_group.favorite = group_favorite
+        current_group.set_weight(group_weight)
+        current_group.set_favorite(group_favorite)
         self.ui_manager.update_image_details(
             self.collections[self.current_collection_index].groups[self.current_group_index].images[
                 self.current_image_index],
@@ -972,6 +1205,7 @@ class ImageViewerApp:
 
         # Keep only the combined collection
         self.collections = [main_collection]
+        self.invalidate_indexes()
 
         # Trim empty groups
         self.trim_groups()
@@ -982,6 +1216,84 @@ class ImageViewerApp:
         # Update the treeview and UI
         self.update_widgets()
 
+    def reindex_groups(self):
+        """Rebuild the group id -> position index of the current collection after groups were added or removed."""
+        if self.collections:
+            groups = self.collections[self.current_collection_index].groups
+            self.group_positions = {group.group_id: position for position, group in enumerate(groups)}
+        else:
+            self.group_positions = {}
+
+    def group_position(self, group):
+        return self.group_positions.get(group.group_id)
+
+    def get_catalog(self):
+        """Return the Catalog of every open group, building it if the groups changed since it was last built."""
+        if self.catalog is None:
+            self.catalog = Catalog(group for collection in self.collections for group in collection.groups)
+        return self.catalog
+
+    def get_tag_index(self):
+        if self.tag_index is None:
+            self.tag_index = TagIndex(group for collection in self.collections for group in collection.groups)
+        return self.tag_index
+
+    def update_tag_index(self, image, added=(), removed=()):
+        """Apply the tags an add_tag/remove_tag call reported as changed to the tag index, if it has been built."""
+        if self.tag_index is not None:
+            self.tag_index.add(image, added)
+            self.tag_index.remove(image, removed)
+
+    def invalidate_indexes(self):
+        """Drop the catalog and tag index, used whenever the set of open groups changes."""
+        if self.catalog is not None:
+            self.catalog.close()
+            self.catalog = None
+        self.tag_index = None
+        if self.random_draw is not None:
+            self.random_draw.close()
+            self.random_draw = None
+
+    def query_images(self, **filters):
+        """Images of the open groups matching filters, see Catalog.query."""
+        return self.get_catalog().query(**filters)
+
+    def open_tag_query(self, event=None):
+        """Ask for a tag query and open its results as a new group after the current one."""
+        query = simpledialog.askstring("Tag Query", "Tags to search for (AND, OR, NOT, parentheses, prefix*):")
+        if not query:
+            return
+        try:
+            group = self.get_tag_index().query_group(query)
+        except ValueError as e:
+            messagebox.showerror("Tag Query", str(e))
+            return
+        print(f"Tag query '{query}' matched {len(group.images)} images")
+        if not group.images:
+            messagebox.showinfo("Tag Query", "No images match this query.")
+            return
+
+        with self.lock:
+            if self.current_gif and self.current_gif.is_animated:
+                self.current_gif.stop()
+        self.prefetcher.cancel()
+
+        current_collection = self.collections[self.current_collection_index]
+        current_group = current_collection.groups[self.current_group_index]
+        self.stored_indices.update({current_group.group_id: self.current_image_index})
+
+        # Opened like any other group, closing it with close_group discards it
+        index = self.current_group_index + 1
+        current_collection.groups.insert(index, group)
+        self.reindex_groups()
+        self.ui_manager.add_notebook_tab(group, index)
+        self.current_group_index = index
+        self.current_image_index = 0
+
+        # Query groups hold images of other groups, the indexes only cover the real ones and don't need rebuilding
+        self.update_widgets()
+        self.display_current_image()
+
     def save_original_collections(self):
         # Restore the original collections before saving
         self.collections = self.original_collections.copy()
@@ -1007,3 +1319,91 @@ class ImageViewerApp:
 
     def print_group_weight(self, event=None):
         print(self.collections[self.current_collection_index].groups[self.current_group_index].weight)
+
+    # ----------------Thumbnails----------------
+
+    def get_thumbnail_atlas(self):
+        collection = self.collections[self.current_collection_index]
+        atlas = self.thumbnail_atlases.get(collection.base_folder_path)
+        if atlas is None:
+            atlas = self.thumbnail_atlases[collection.base_folder_path] = ThumbnailAtlas(collection.base_folder_path)
+        return atlas
+
+    def toggle_thumbnail_grid(self, event=None):
+        if self.thumbnail_grid_shown:
+            self.thumbnail_grid.place_forget()
+            self.thumbnail_grid_shown = False
+            self.thumbnail_group = None
+
+            # Stops the generation run once its current result is in
+            self.thumbnail_generation += 1
+            return
+
+        if not self.collections:
+            return
+        self.thumbnail_grid.place(x=0, y=0, relwidth=1, relheight=1)
+        self.thumbnail_grid_shown = True
+        self.update_thumbnail_grid()
+
+    def update_thumbnail_grid(self):
+        """Show the current group in the thumbnail grid, if it's open, generating any thumbnails it is missing."""
+        if not self.thumbnail_grid_shown:
+            return
+        current_group = self.collections[self.current_collection_index].groups[self.current_group_index]
+        atlas = self.get_thumbnail_atlas()
+        self.thumbnail_grid.show(atlas, current_group.images, self.current_image_index)
+
+        if current_group is self.thumbnail_group:
+            return
+        self.thumbnail_group = current_group
+        self.thumbnail_generation += 1
+        generation = self.thumbnail_generation
+        paths = [image.path for image in current_group.images]
+        if self.thumbnail_processes is None:
+            self.thumbnail_processes = thumbnail_pool()
+        self.thumbnail_job = self.thumbnail_worker.submit(
+            atlas.generate, paths, cancelled=lambda: generation != self.thumbnail_generation,
+            executor=self.thumbnail_processes)
+        self.root.after(THUMBNAIL_POLL_INTERVAL, self.poll_thumbnails, self.thumbnail_job)
+
+    def poll_thumbnails(self, job):
+        # Thumbnails land in the atlas from the worker thread, the grid picks them up here on the Tk thread
+        if job is not self.thumbnail_job or not self.thumbnail_grid_shown:
+            return
+        self.thumbnail_grid.refresh()
+        if job.done():
+            if job.exception() is not None:
+                print(f"Thumbnail generation failed: {job.exception()}")
+            return
+        self.root.after(THUMBNAIL_POLL_INTERVAL, self.poll_thumbnails, job)
+
+    def on_thumbnail_selected(self, index):
+        self.stop_gif_animation()
+        self.current_image_index = index
+        self.toggle_thumbnail_grid()
+        self.display_current_image()
+
+    # ----------------Shutdown----------------
+
+    def shutdown(self):
+        """Stop every background job so the process can exit, used when the window is closed."""
+        self.stop_gif_animation()
+
+        # A thumbnail run stops at its next result, the other workers drop whatever hasn't started yet
+        self.thumbnail_generation += 1
+        self.thumbnail_worker.shutdown(wait=False, cancel_futures=True)
+        if self.thumbnail_processes is not None:
+            self.thumbnail_processes.shutdown(wait=False, cancel_futures=True)
+        if self.gif_build is not None:
+            self.gif_build[1].cancel()
+        self.gif_worker.shutdown(wait=False, cancel_futures=True)
+        self.prefetcher.shutdown()
+        self.render_worker.shutdown()
+
+        if self.session_loader is not None:
+            self.session_loader.close()
+            self.session_loader = None
+
+    def print_cache_stats(self, event=None):
+        print(f"Image cache: {self.image_cache.stats()}")
+        print(f"GIF frame cache: {self.gif_frame_cache.stats()}")
@@ -3,7 +3,16 @@ import tkinter as tk
 from tkinter import filedialog, simpledialog, ttk, messagebox
 import pickle
 from ImageViewerApp import ImageViewerApp
-from Structures import Collection, SmartImage, GifImage
+from Structures import Collection, Group, SmartImage, GifImage, dirty_tracker
+from ScanIndex import ScanIndex
+from MetadataStore import MetadataStore, Autosaver
+from Session import SESSION_EXTENSION, SessionLoader, is_session_file, write_session
+
+# Rows inserted at once when a Treeview node is expanded, the rest are behind a "more" row
+TREEVIEW_PAGE_SIZE = 500
+
+# Milliseconds between checks on a session that is still being read in the background
+SESSION_POLL_INTERVAL = 200
 
 
 class MainApp:
@@ -18,6 +27,14 @@ class MainApp:
         self.image_viewer_app = None
         self.collections = []
 
+        # Image metadata lives in a single store, older per-image pickle files are imported the first time
+        self.metadata_store = MetadataStore()
+        if not self.metadata_store.pickles_imported():
+            self.metadata_store.import_pickle_tree("data")
+
+        # Changed images and groups are written in the background, started once collections are loaded
+        self.autosaver = Autosaver(self.metadata_store, self.image_data, self.group_data)
+
         self.initialize_ui()
 
         # Boolean for visibility
@@ -26,6 +43,9 @@ class MainApp:
         # Bind hotkey to hide and show dialog
         self.root.bind('<Control-h>', self.hide_window)
 
+        # Write pending changes before the window goes away
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
     def initialize_ui(self):
         self.dialog = tk.Toplevel(self.root)
         self.dialog.title("Load Folder")
@@ -57,6 +77,13 @@ class MainApp:
         self.tree = ttk.Treeview(self.frame)
         self.tree.grid(row=4, column=0, columnspan=2, padx=10, pady=10, sticky=tk.NSEW)
 
+        # Rows are only inserted once their parent is expanded. item id -> children for nodes still showing a
+        # placeholder, and item id -> (parent item, children, next index) for "Show more" rows
+        self.tree_pending = {}
+        self.tree_more = {}
+        self.tree.bind("<<TreeviewOpen>>", self.on_tree_open)
+        self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+
         # Save and Load buttons
         self.save_button = tk.Button(self.frame, text="Save Data", command=self.save_all_image_data)
         self.save_button.grid(row=5, column=0, padx=10, pady=5, sticky=tk.W)
@@ -84,7 +111,12 @@ class MainApp:
             print(f"Selected folder: {self.folder_path}")
             self.collections = []
             new_collection = Collection(self.folder_path, os.path.basename(self.folder_path))
-            new_collection.load_groups()
+
+            # Only directories that changed since the folder was last opened are listed again
+            index = ScanIndex(self.folder_path)
+            index.load()
+            new_collection.load_groups(index=index)
+            index.save()
             self.collections.append(new_collection)
             self.display_collections_in_treeview()
 
@@ -100,7 +132,8 @@ class MainApp:
             # Automatically load data if the checkbox is checked
             if self.auto_load_var.get():
                 self.load_all_image_data()
-            
+            self.autosaver.start()
+
             self.image_viewer_app.display_current_image()
 
     def apply_whitelist_blacklist(self):
@@ -112,49 +145,8 @@ class MainApp:
         if blacklist:
             blacklist = [item.strip() for item in blacklist if item.strip()]
 
-        filtered_collections = []
-
-        # For every collection in collections
-        for collection in self.collections:
-
-            # Create filtered version of each collection
-            filtered_collection = Collection(collection.base_folder_path, collection.name)
-
-            # For each group in every collection
-            for group in collection.groups:
-            
-                # If the group should be included and is not already in the collection
-                if self._should_include_group(group, whitelist, blacklist) and group not in filtered_collection.groups:
-                    filtered_collection.add_group(group)
-                else:
-                    self._filter_group_recursive(group, filtered_collection, whitelist, blacklist)
-            filtered_collections.append(filtered_collection)
-
-#Group1,NestledFolder1
-
-
-        self.collections = filtered_collections
-
-    def _should_include_group(self, group, whitelist, blacklist):
-        if whitelist and group.name in whitelist:
-            print(f"{group.name} was found in whitelist\n")
-            return True
-        
-        # Check if the group or any of its parents are in the blacklist
-        current_group = group
-        while current_group:
-            if blacklist and current_group.name in blacklist:
-                return False
-            current_group = current_group.parent
-        
-        # Return False if there is a whitelist present, True if not
-        return not whitelist
-
-    def _filter_group_recursive(self, group, filtered_collection, whitelist, blacklist):
-        for child in group.children:
-            if self._should_include_group(child, whitelist, blacklist):
-                filtered_collection.add_group(child)
-            self._filter_group_recursive(child, filtered_collection, whitelist, blacklist)
+        # The same filter BatchRender uses, so both see the same groups
+        self.collections = [collection.filtered(whitelist, blacklist) for collection in self.collections]
 
     def hide_window(self, event=None):
         if not self.hidden:
@@ -165,14 +157,44 @@ class MainApp:
 
     def display_collections_in_treeview(self):
         self.tree.delete(*self.tree.get_children())
+        self.tree_pending = {}
+        self.tree_more = {}
         for collection in self.collections:
             col_id = self.tree.insert("", tk.END, text=collection.name)
-            for group in collection.groups:
-                group_id = self.tree.insert(col_id, tk.END, text=group.name)
-                for image in group.images:
-                    self.tree.insert(group_id, tk.END, text=image.name)
-
-    def save_image_data(self, image):
+            self.add_tree_placeholder(col_id, collection.groups)
+
+    def add_tree_placeholder(self, item, children):
+        # The placeholder only makes the node expandable, it is replaced by the real rows when the node is opened
+        if children:
+            self.tree.insert(item, tk.END, text="Loading...")
+            self.tree_pending[item] = children
+
+    def on_tree_open(self, event=None):
+        item = self.tree.focus()
+        children = self.tree_pending.pop(item, None)
+        if children is not None:
+            self.tree.delete(*self.tree.get_children(item))
+            self.insert_tree_page(item, children, 0)
+
+    def on_tree_select(self, event=None):
+        for item in self.tree.selection():
+            if item in self.tree_more:
+                parent, children, start = self.tree_more.pop(item)
+                self.tree.delete(item)
+                self.insert_tree_page(parent, children, start)
+
+    def insert_tree_page(self, parent, children, start):
+        """Insert up to TREEVIEW_PAGE_SIZE rows of children under parent, followed by a row that loads the rest."""
+        end = min(start + TREEVIEW_PAGE_SIZE, len(children))
+        for child in children[start:end]:
+            child_id = self.tree.insert(parent, tk.END, text=child.name)
+            if isinstance(child, Group):
+                self.add_tree_placeholder(child_id, child.images)
+        if end < len(children):
+            more_id = self.tree.insert(parent, tk.END, text=f"Show more ({len(children) - end} remaining)")
+            self.tree_more[more_id] = (parent, children, end)
+
+    def image_data(self, image):
         data = {
             "path": image.path,
             "name": image.name,
@@ -193,53 +215,83 @@ class MainApp:
         if isinstance(image, GifImage):
             data["durations"] = image.durations
             data["animation_speed"] = image.animation_speed
+            data["frame_count"] = image.frame_count
 
-        # Create directory structure
-        base_dir = "data"
-        group_dir = os.path.join(base_dir, image.group)
-        self.ensure_directory(group_dir)
-        filename = os.path.join(group_dir, os.path.basename(image.path) + ".pkl")
-        with open(filename, "wb") as f:
-            pickle.dump(data, f)
-
-    def load_image_data(self, image_path, group):
-        base_dir = "data"
-        group_dir = os.path.join(base_dir, group)
-        filename = os.path.join(group_dir, os.path.basename(image_path) + ".pkl")
-        if os.path.exists(filename):
-            with open(filename, "rb") as f:
-                data = pickle.load(f)
-                data['path'] = image_path  # Ensure the correct path is used
-            
-            # Create the appropriate instance based on the data
-            if "durations" in data and "animation_speed" in data:
-                return GifImage(**data)
-            else:
-                return SmartImage(**data)
+        return data
+
+    def group_data(self, group):
+        return {
+            "path": group.folder_path,
+            "name": group.name,
+            "weight": group.weight,
+            "favorite": group.favorite,
+        }
+
+    def save_image_data(self, image):
+        self.metadata_store.save_many([self.image_data(image)])
+
+    def load_image_data(self, image_path, group=None):
+        data = self.metadata_store.load(image_path)
+        if data is not None:
+            return self.create_image(data, image_path)
         return None
 
+    def create_image(self, data, image_path):
+        data['path'] = image_path  # Ensure the correct path is used
+
+        # Create the appropriate instance based on the data
+        if "durations" in data and "animation_speed" in data:
+            return GifImage(**data)
+        else:
+            return SmartImage(**data)
+
     def update_widgets(self, *args, **kwargs):
         # Placeholder method for update callback
         print("Widgets updated with args:", args, "and kwargs:", kwargs)
 
     def save_all_image_data(self):
         if self.image_viewer_app:
-            for collection in self.image_viewer_app.collections:
-                for group in collection.groups:
-                    for image in group.images:
-                        self.save_image_data(image)
-            print("All image data saved.")
+            # Everything is written below, so the pending autosave marks can go. Anything changed while this runs
+            # gets marked again and is picked up by the next autosave
+            dirty_tracker.drain()
+
+            # Everything is written in one transaction
+            groups = [group for collection in self.image_viewer_app.collections for group in collection.groups
+                      if not group.virtual]
+            saved = self.metadata_store.save_many(self.image_data(image) for group in groups for image in group.images)
+            self.metadata_store.save_groups(self.group_data(group) for group in groups)
+            print(f"All image data saved ({saved} images).")
 
     def load_all_image_data(self):
         if self.image_viewer_app:
-            for collection in self.image_viewer_app.collections:
-                for group in collection.groups:
-                    for image in group.images:
-                        loaded_image = self.load_image_data(image.path, group.name)
-                        if loaded_image:
-                            image.__dict__.update(loaded_image.__dict__)
+            groups = [group for collection in self.image_viewer_app.collections for group in collection.groups
+                      if not group.virtual]
+            images = [image for group in groups for image in group.images]
+
+            # Fetch every record with a single bulk read
+            records = self.metadata_store.load_many(image.path for image in images)
+            for image in images:
+                data = records.get(image.path)
+                if data is not None:
+                    loaded_image = self.create_image(data, image.path)
+                    image.update_from(loaded_image)
+
+            # Loaded values are assigned directly, they match what is stored and shouldn't be marked dirty
+            group_records = self.metadata_store.load_groups(group.folder_path for group in groups)
+            for group in groups:
+                data = group_records.get(group.folder_path)
+                if data is not None:
+                    group.weight = data["weight"]
+                    group.favorite = data["favorite"]
             print("All image data loaded.")
 
+    def on_close(self):
+        if self.image_viewer_app is not None:
+            self.image_viewer_app.shutdown()
+        self.autosaver.stop()
+        self.metadata_store.close()
+        self.root.destroy()
+
     def ensure_directory(self, path):
         if not os.path.exists(path):
             os.makedirs(path)
@@ -247,40 +299,94 @@ class MainApp:
     def save_session(self):
         session_name = simpledialog.askstring("Save Session", "Enter a name for the session:")
         if session_name:
+            viewer = self.image_viewer_app
             use_combined = messagebox.askyesno("Save Session", "Use combined collections?")
             if use_combined:
-                collections_to_save = [self.image_viewer_app.collections[0]]  # Combined collection
+                collections_to_save = [viewer.collections[0]]  # Combined collection
                 print(f"Saving combined collection: {collections_to_save}")
             else:
-                collections_to_save = self.image_viewer_app.original_collections  # Original collections
+                collections_to_save = viewer.original_collections  # Original collections
                 print(f"Saving original collections: {collections_to_save}")
 
+            # Groups of a session that is still loading have to be read before they can be written out
+            if viewer.session_loader is not None:
+                viewer.session_loader.hydrate_all()
+
             # Ensure the session directory exists
             session_dir = "sessions"
             if not os.path.exists(session_dir):
                 os.makedirs(session_dir)
 
-            # Save the session data
-            session_path = os.path.join(session_dir, f"{session_name}.pkl")
-            with open(session_path, "wb") as f:
-                pickle.dump(collections_to_save, f)
+            # Only the structure and metadata are saved, starting with the group being viewed
+            current_group = viewer.collections[viewer.current_collection_index].groups[viewer.current_group_index]
+            stored_indices = dict(viewer.stored_indices, **{current_group.group_id: viewer.current_image_index})
+            session_path = os.path.join(session_dir, f"{session_name}{SESSION_EXTENSION}")
+            write_session(session_path, collections_to_save, self.image_data, current_group,
+                          viewer.current_image_index, stored_indices)
             print(f"Session '{session_name}' saved.")
 
     def load_session(self):
-        filename = filedialog.askopenfilename(title="Select Session File", initialdir="sessions", filetypes=[("Pickle Files", "*.pkl")])
+        filename = filedialog.askopenfilename(title="Select Session File", initialdir="sessions",
+                                              filetypes=[("Sessions", f"*{SESSION_EXTENSION}"),
+                                                         ("Pickle Files", "*.pkl")])
         if filename:
             print(f"Loading session from {filename}")
-            with open(filename, "rb") as f:
-                loaded_collections = pickle.load(f)
+            if self.image_viewer_app is not None and self.image_viewer_app.session_loader is not None:
+                self.image_viewer_app.session_loader.close()
 
-            self.image_viewer_app = ImageViewerApp(self.root, self.update_widgets)
-            self.image_viewer_app.collections = loaded_collections
-            self.image_viewer_app.combine_collections()
+            if is_session_file(filename):
+                self.load_streamed_session(filename)
+            else:
+                # Sessions saved before the streaming format pickled the whole collection graph
+                with open(filename, "rb") as f:
+                    loaded_collections = pickle.load(f)
+
+                self.image_viewer_app = ImageViewerApp(self.root, self.update_widgets)
+                self.image_viewer_app.collections = loaded_collections
+                self.image_viewer_app.combine_collections()
+            self.autosaver.start()
             self.display_collections_in_treeview()
             self.hide_window()  # Automatically hide window
             self.root.deiconify()  # Show the main window now that collections have been loaded
             print(f"Session loaded from {filename}")
 
+    def load_streamed_session(self, filename):
+        # Only the group that was being viewed is read before it is shown, the rest are read in the background
+        loader = SessionLoader(filename, self.create_image)
+        loaded_collections, current_group, image_index = loader.open()
+
+        viewer = ImageViewerApp(self.root, self.update_widgets)
+        viewer.session_loader = loader
+        viewer.stored_indices = dict(loader.stored_indices)
+        viewer.collections = loaded_collections
+        viewer.combine_collections()
+        self.image_viewer_app = viewer
+
+        position = viewer.group_position(current_group) if current_group is not None else None
+        if position is not None:
+            viewer.current_group_index = position
+            viewer.current_image_index = image_index
+            viewer.update_widgets()
+        viewer.display_current_image()
+
+        loader.start()
+        self.root.after(SESSION_POLL_INTERVAL, self.poll_session_loader, viewer)
+
+    def poll_session_loader(self, viewer):
+        loader = viewer.session_loader
+        if loader is None:
+            return
+        if not loader.done.is_set():
+            self.root.after(SESSION_POLL_INTERVAL, self.poll_session_loader, viewer)
+            return
+
+        # Every group is read, indexes built while the session was loading only covered part of it
+        loader.close()
+        viewer.session_loader = None
+        viewer.invalidate_indexes()
+        print(f"Session {loader.path} fully loaded ({len(loader.header['order'])} groups)")
+
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = MainApp(root)
@@ -0,0 +1,76 @@
+import argparse
+import gc
+import tracemalloc
+
+from Structures import SmartImage
+
+
+class LegacySmartImage:
+    """Replica of SmartImage as it was before it used __slots__, kept only to compare against."""
+
+    def __init__(self, path, name, group, default_zoom_level=1.0, default_panx=0, default_pany=0, series="", index=0,
+                 offset=None, weight=1.0, tags=None, favorite=False, preconfig=None):
+        if preconfig is None:
+            preconfig = []
+        if tags is None:
+            tags = []
+        self.path = path
+        self.name = name
+        self.group = group
+        self.default_zoom_level = default_zoom_level
+        self.zoom_level = default_zoom_level
+        self.default_panx = default_panx
+        self.default_pany = default_pany
+        self.panx = self.default_panx
+        self.pany = self.default_pany
+        self.series = series
+        self.index = index
+        self.offset = offset
+        self.weight = weight
+        self.tags = tags
+        self.favorite = favorite
+        self.preconfig = preconfig
+
+
+def build(cls, paths, tag_every, tags_per_image):
+    images = []
+    for i, path in enumerate(paths):
+        tags = None
+        if tag_every and i % tag_every == 0:
+            # Tags come out of str.split/strip/lower, so every image gets its own string objects
+            tags = [f"tag{(i + k) % 50}".lower() for k in range(tags_per_image)]
+        images.append(cls(path, path.rsplit("/", 1)[-1], "group", tags=tags))
+    return images
+
+
+def measure(cls, paths, tag_every, tags_per_image):
+    """Return the bytes allocated per image while building len(paths) images of cls."""
+    gc.collect()
+    tracemalloc.start()
+    images = build(cls, paths, tag_every, tags_per_image)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del images
+    return used / len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the memory used per SmartImage before and after __slots__")
+    parser.add_argument("--count", type=int, default=200000, help="number of images to build")
+    parser.add_argument("--tag-every", type=int, default=4, help="tag one image in this many, 0 for no tags")
+    parser.add_argument("--tags-per-image", type=int, default=3)
+    args = parser.parse_args()
+
+    # Paths are created up front, they cost the same in both layouts
+    paths = [f"/library/group{i // 1000}/image{i}.jpg" for i in range(args.count)]
+
+    before = measure(LegacySmartImage, paths, args.tag_every, args.tags_per_image)
+    after = measure(SmartImage, paths, args.tag_every, args.tags_per_image)
+    print(f"{args.count} images, one in {args.tag_every} tagged with {args.tags_per_image} tags")
+    print(f"Before: {before:.0f} bytes per image ({before * args.count / 2 ** 20:.1f} MB)")
+    print(f"After:  {after:.0f} bytes per image ({after * args.count / 2 ** 20:.1f} MB)")
+    print(f"Saved:  {1 - after / before:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import os
+import pickle
+import sqlite3
+import threading
+
+from Structures import Group, dirty_tracker
+
+STORE_PATH = os.path.join("data", "metadata.db")
+
+# Seconds between two autosaves
+AUTOSAVE_INTERVAL = 30
+
+# SQLite limits the number of parameters in one statement, bulk reads are split into chunks of this size
+READ_CHUNK_SIZE = 900
+
+
+class MetadataStore:
+    """Single-file SQLite store for image metadata, keyed by image path.
+
+    Each record is the same dictionary that used to be pickled into data/<group>/<image>.pkl, stored as a pickled
+    blob. Writes are batched into one transaction and reads can fetch any number of paths at once. Group weights and
+    favorites are kept the same way in a second table, keyed by folder path.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        # The connection is shared between threads, the lock keeps statements from interleaving
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS groups (path TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def save_many(self, records, table="images"):
+        """Write an iterable of metadata dictionaries in a single transaction. Returns how many were written."""
+        rows = [(record["path"], pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)) for record in records]
+        with self.lock, self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO {table} (path, data) VALUES (?, ?)", rows)
+        return len(rows)
+
+    def load_many(self, paths=None, table="images"):
+        """Return {path: metadata} for the given paths, or for every stored record when paths is None."""
+        records = {}
+        with self.lock:
+            if paths is None:
+                for path, data in self.connection.execute(f"SELECT path, data FROM {table}"):
+                    records[path] = pickle.loads(data)
+                return records
+
+            paths = list(paths)
+            for start in range(0, len(paths), READ_CHUNK_SIZE):
+                chunk = paths[start:start + READ_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                query = f"SELECT path, data FROM {table} WHERE path IN ({placeholders})"
+                for path, data in self.connection.execute(query, chunk):
+                    records[path] = pickle.loads(data)
+        return records
+
+    def save_groups(self, records):
+        return self.save_many(records, table="groups")
+
+    def load_groups(self, paths=None):
+        return self.load_many(paths, table="groups")
+
+    def load(self, path):
+        return self.load_many([path]).get(path)
+
+    def paths(self):
+        with self.lock:
+            return {row[0] for row in self.connection.execute("SELECT path FROM images")}
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def import_pickle_tree(self, base_dir="data", batch_size=5000):
+        """Import the per-image pickle files of the old data/<group>/ layout. Returns how many were imported.
+
+        Records already in the store are left alone, so running it again after saving new data is harmless.
+        """
+        imported = 0
+        batch = []
+        existing = self.paths()
+        for folder, _, files in os.walk(base_dir):
+            for file_name in files:
+                if not file_name.endswith(".pkl"):
+                    continue
+                try:
+                    with open(os.path.join(folder, file_name), "rb") as f:
+                        record = pickle.load(f)
+                except Exception as e:
+                    print(f"Skipping unreadable metadata file {file_name}: {e}")
+                    continue
+                if record.get("path") in existing:
+                    continue
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    imported += self.save_many(batch)
+                    batch = []
+        imported += self.save_many(batch)
+
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('pickles_imported', '1')")
+        print(f"Imported {imported} image records from {base_dir}")
+        return imported
+
+    def pickles_imported(self):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'pickles_imported'").fetchone()
+        return row is not None
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class Autosaver:
+    """Background thread that periodically writes the images and groups marked dirty, and nothing else.
+
+    image_record and group_record turn a SmartImage or Group into the dictionary stored for it.
+    """
+
+    def __init__(self, store, image_record, group_record, interval=AUTOSAVE_INTERVAL, tracker=dirty_tracker):
+        self.store = store
+        self.image_record = image_record
+        self.group_record = group_record
+        self.interval = interval
+        self.tracker = tracker
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # Keeps a flush on the main thread from overlapping with the background one
+        self.flush_lock = threading.Lock()
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="autosave", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the thread and write whatever is still dirty."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def flush(self):
+        """Write every dirty record now. Returns how many records were written."""
+        with self.flush_lock:
+            dirty = self.tracker.drain()
+            if not dirty:
+                return 0
+
+            groups = [obj for obj in dirty if isinstance(obj, Group)]
+            images = [obj for obj in dirty if not isinstance(obj, Group)]
+            try:
+                saved = self.store.save_many(self.image_record(image) for image in images)
+                saved += self.store.save_groups(self.group_record(group) for group in groups)
+            except Exception as e:
+                # Mark everything again so the next autosave retries it
+                print(f"Autosave failed, retrying later: {e}")
+                for obj in dirty:
+                    self.tracker.mark(obj)
+                return 0
+        print(f"Autosaved {saved} changed records")
+        return saved
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.flush()
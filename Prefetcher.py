@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import Renderer
+from Structures import GifImage
+
+
+class Prefetcher:
+    """Decodes and scales the images around the current one on a thread pool before they are navigated to."""
+
+    def __init__(self, cache, screen_width, screen_height, ahead=3, behind=1, workers=2, disk_cache=None):
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+
+        # How many images after and before the current one to prepare
+        self.ahead = ahead
+        self.behind = behind
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+
+        # Shared ImageCache the results are written to, and the RenderCache of earlier runs checked before decoding
+        self.cache = cache
+        self.disk_cache = disk_cache
+
+        # key -> Future for jobs that have been submitted but not finished
+        self.pending = {}
+
+        # Bumped on cancel so that jobs which were already picked up by a worker skip their work
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def prefetch(self, images, index, wrap=False):
+        """Queue the neighbours of images[index] that aren't already queued."""
+        if not images:
+            return
+
+        offsets = list(range(1, self.ahead + 1)) + [-i for i in range(1, self.behind + 1)]
+        for offset in offsets:
+            i = index + offset
+            if wrap:
+                i %= len(images)
+            elif i < 0 or i >= len(images):
+                continue
+
+            smart_image = images[i]
+
+            # GIFs have their own frame handling
+            if isinstance(smart_image, GifImage):
+                continue
+
+            key = (smart_image.path, smart_image.zoom_level)
+            with self.lock:
+                if key in self.pending:
+                    continue
+                # Renders at the default zoom are the ones worth keeping on disk for the next run
+                persist = smart_image.zoom_level == smart_image.default_zoom_level
+                self.pending[key] = self.executor.submit(self._job, smart_image.path, smart_image.zoom_level, persist,
+                                                         key, self.generation)
+
+    def cancel(self):
+        """Drop all queued jobs, used when the user jumps to another group."""
+        with self.lock:
+            self.generation += 1
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _job(self, path, zoom_level, persist, key, generation):
+        try:
+            if generation != self.generation:
+                return
+            # Images already in the cache come straight back out of it
+            Renderer.load_scaled(self.cache, path, self.screen_width, self.screen_height, zoom_level,
+                                 self.disk_cache, persist)
+        except Exception as e:
+            print(f"Error prefetching {path}: {e}")
+        finally:
+            with self.lock:
+                if generation == self.generation:
+                    self.pending.pop(key, None)
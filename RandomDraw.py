@@ -0,0 +1,198 @@
+import random
+import threading
+from array import array
+from collections import deque
+
+from Structures import Group, dirty_tracker
+
+
+def build_tree(values, typecode):
+    """Fenwick tree array over values, tree[i] holds the sum of a power of two sized range ending at i (1 based)."""
+    tree = array(typecode, [0]) + array(typecode, values)
+    for i in range(1, len(values) + 1):
+        parent = i + (i & -i)
+        if parent <= len(values):
+            tree[parent] += tree[i]
+    return tree
+
+
+class FenwickTree:
+    """Binary indexed tree over non-negative weights, with O(log n) updates and weighted sampling.
+
+    A second tree counts the positive weights. Counts are exact where the float sums drift, so they decide whether
+    anything can be drawn at all and land find() on a positive weight when rounding puts it on a zero one.
+    """
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.weights = array("d", weights)
+        self.tree = build_tree(self.weights, "d")
+        self.total = sum(self.weights)
+
+        self.counts = build_tree([int(weight > 0) for weight in self.weights], "q")
+        self.positive = sum(weight > 0 for weight in self.weights)
+
+    def update(self, index, weight):
+        old_weight = self.weights[index]
+        delta = weight - old_weight
+        if not delta:
+            return
+        self.weights[index] = weight
+        self.total += delta
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+        count_delta = (weight > 0) - (old_weight > 0)
+        if count_delta:
+            self.positive += count_delta
+            i = index + 1
+            while i <= self.size:
+                self.counts[i] += count_delta
+                i += i & -i
+        if not self.positive:
+            # Adding and subtracting leaves a tiny remainder behind instead of 0
+            self.total = 0.0
+
+    def descend(self, tree, value):
+        """Last position whose prefix sum in tree is <= value, the 0 based index whose range contains value."""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            next_position = position + step
+            if next_position <= self.size and tree[next_position] <= value:
+                position = next_position
+                value -= tree[next_position]
+            step >>= 1
+        return position
+
+    def rank(self, index):
+        """Number of positive weights before index."""
+        count = 0
+        while index > 0:
+            count += self.counts[index]
+            index -= index & -index
+        return count
+
+    def find(self, value):
+        """Index of the weight whose cumulative range contains value, for 0 <= value < total.
+
+        Always a positive weight as long as there is one. Rounding at a range boundary can land on a zero weight,
+        the next positive weight is taken instead, or the last one if there is none after it.
+        """
+        index = min(self.descend(self.tree, value), self.size - 1)
+        if self.weights[index] <= 0 and self.positive:
+            index = self.descend(self.counts, min(self.rank(index), self.positive - 1))
+        return index
+
+
+class RandomDraw:
+    """Draws images at random, each with probability proportional to image weight x group weight.
+
+    Draws and weight changes are O(log n). With no_repeat, an image can't be drawn again until no_repeat other
+    draws have been made, which is done by zeroing its weight while it is in the window. The window is capped at one
+    less than the number of images, so a small collection still has something to draw. Weight changes made through
+    the SmartImage and Group mutators are picked up from the dirty tracker before the next draw.
+    """
+
+    def __init__(self, groups, no_repeat=0, rng=None):
+        self.rng = rng or random.Random()
+        self.no_repeat = no_repeat
+
+        # Virtual groups only hold images of other groups
+        self.groups = [group for group in groups if not group.virtual]
+
+        # Every image along with the group it was drawn from and its position in that group
+        self.images = []
+        self.locations = []
+        self.positions = {}
+        self.group_ranges = {}
+
+        weights = []
+        for group in self.groups:
+            start = len(self.images)
+            for image_index, image in enumerate(group.images):
+                self.positions[image] = len(self.images)
+                self.images.append(image)
+                self.locations.append((group, image_index))
+                weights.append(draw_weight(image, group))
+            self.group_ranges[group] = (start, len(self.images))
+
+        self.tree = FenwickTree(weights)
+
+        # Indices drawn recently, with their weights zeroed in the tree until they leave the window
+        self.window = deque()
+        self.window_weights = {}
+
+        self.changed = set()
+        self.lock = threading.Lock()
+        dirty_tracker.add_listener(self.on_change)
+
+    def close(self):
+        """Stop following weight changes, used when the draw is replaced."""
+        dirty_tracker.remove_listener(self.on_change)
+
+    def __len__(self):
+        return len(self.images)
+
+    def draw(self):
+        """Return (group, image index within the group) of a random image, or None if every weight is zero."""
+        self.refresh()
+        while not self.tree.positive and self.window:
+            # Fewer images can be drawn than the window is long, let the oldest ones back in
+            self.release_oldest()
+        if not self.tree.positive:
+            return None
+
+        # Images in the window have a zero weight in the tree, which find() never returns
+        index = self.tree.find(self.rng.random() * self.tree.total)
+
+        # The window always leaves at least one image out, so there is something to draw next time
+        window_size = min(self.no_repeat, len(self.images) - 1)
+        if window_size > 0:
+            self.window_weights[index] = self.tree.weights[index]
+            self.window.append(index)
+            self.tree.update(index, 0.0)
+            while len(self.window) > window_size:
+                self.release_oldest()
+        return self.locations[index]
+
+    def release_oldest(self):
+        index = self.window.popleft()
+        self.tree.update(index, self.window_weights.pop(index))
+
+    def set_weight(self, index, weight):
+        if index in self.window_weights:
+            # Applied once the image leaves the window
+            self.window_weights[index] = weight
+        else:
+            self.tree.update(index, weight)
+
+    def on_change(self, obj):
+        with self.lock:
+            self.changed.add(obj)
+
+    def refresh(self):
+        """Apply the weight changes made to images and groups since the last draw."""
+        if not self.changed:
+            return
+        with self.lock:
+            changed = list(self.changed)
+            self.changed.clear()
+
+        for obj in changed:
+            if isinstance(obj, Group):
+                start, end = self.group_ranges.get(obj, (0, 0))
+                for index in range(start, end):
+                    self.set_weight(index, draw_weight(self.images[index], obj))
+                continue
+
+            index = self.positions.get(obj)
+            if index is not None:
+                self.set_weight(index, draw_weight(obj, self.locations[index][0]))
+
+
+def draw_weight(image, group):
+    # Negative weights would corrupt the tree, they are treated as never drawn
+    return max(0.0, float(image.weight) * float(group.weight))
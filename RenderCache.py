@@ -0,0 +1,156 @@
+import hashlib
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+RENDER_CACHE_DIRECTORY = "renders"
+
+# Disk space allowed for renders, the least recently used ones are deleted past it
+RENDER_CACHE_BYTES = 4 * 1024 * 1024 * 1024
+
+# A trim deletes renders until the cache is down to this fraction of its limit, so it doesn't run on every write
+TRIM_TARGET = 0.9
+
+# Part of every key, bumped when the way renders are stored changes so older renders are no longer found. They are
+# left for the trim to delete
+RENDER_FORMAT = 2
+
+
+def source_signature(path):
+    """(size, mtime in ns) of the file at path, or None if it can't be read."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class RenderCache:
+    """Screen-sized renders kept on disk between runs, one file per render.
+
+    A render is keyed by the path, size and modification time of its source file along with the zoom level and
+    screen size it was scaled for, so editing a file or changing the screen simply stops its old renders from being
+    found. The pan isn't part of the key, renders are never panned, the viewport moves them instead. Files are written
+    under a temporary name and renamed into place, which lets several processes fill the cache at once and means an
+    interrupted write never leaves a partial render behind.
+
+    The modification time of a render file is its last use, get() bumps it. Once the renders take up more than
+    max_bytes the least recently used are deleted. With max_bytes None nothing is tracked or deleted, which is how the
+    batch render worker processes use it, leaving the trim to their parent.
+    """
+
+    def __init__(self, directory=RENDER_CACHE_DIRECTORY, max_bytes=RENDER_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        # Bytes on disk, unknown until the first trim has scanned the directory
+        self.total_bytes = None
+        self.lock = threading.Lock()
+
+        # Encodes and writes renders handed to store(), created on first use
+        self.writer = None
+
+    def key(self, path, zoom_level, screen_width, screen_height, signature=None):
+        if signature is None:
+            signature = source_signature(path)
+            if signature is None:
+                return None
+        text = repr((RENDER_FORMAT, os.path.abspath(path), signature, float(zoom_level), screen_width, screen_height))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def file_path(self, key):
+        # Spread over subdirectories so no single directory ends up with every render
+        return os.path.join(self.directory, key[:2], key)
+
+    def contains(self, path, zoom_level, screen_width, screen_height):
+        key = self.key(path, zoom_level, screen_width, screen_height)
+        return key is not None and os.path.exists(self.file_path(key))
+
+    def get(self, path, zoom_level, screen_width, screen_height):
+        """The cached render of path, or None if there isn't an up to date one."""
+        key = self.key(path, zoom_level, screen_width, screen_height)
+        if key is None:
+            return None
+        file_path = self.file_path(key)
+        try:
+            with Image.open(file_path) as image:
+                image.load()
+            os.utime(file_path)
+            return image
+        except (OSError, ValueError):
+            return None
+
+    def put(self, path, zoom_level, screen_width, screen_height, image, signature=None):
+        """Store a render of path. signature should be taken before the source was read, see source_signature."""
+        key = self.key(path, zoom_level, screen_width, screen_height, signature)
+        if key is None:
+            return
+        file_path = self.file_path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        # Stored losslessly, a cached render has to look exactly like the one it replaces. The lowest compression
+        # level keeps the encode cheap and the decode stays far below that of the source
+        temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        image.save(temp_path, "PNG", compress_level=1)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, file_path)
+
+        if self.max_bytes is None:
+            return
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += size
+            needs_trim = self.total_bytes is None or self.total_bytes > self.max_bytes
+        if needs_trim:
+            self.trim()
+
+    def store(self, path, zoom_level, screen_width, screen_height, image, signature=None):
+        """put() on a background thread, for callers that shouldn't wait for the encode and write."""
+        if self.writer is None:
+            self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render-cache")
+        if signature is None:
+            signature = source_signature(path)
+        self.writer.submit(self._store, path, zoom_level, screen_width, screen_height, image, signature)
+
+    def _store(self, *args):
+        try:
+            self.put(*args)
+        except (OSError, ValueError) as e:
+            print(f"Couldn't write render of {args[0]}: {e}")
+
+    def trim(self):
+        """Delete the least recently used renders until the cache fits in max_bytes. Returns how many were deleted."""
+        entries = []
+        total = 0
+        if os.path.isdir(self.directory):
+            with os.scandir(self.directory) as subdirectories:
+                for subdirectory in subdirectories:
+                    if not subdirectory.is_dir():
+                        continue
+                    with os.scandir(subdirectory.path) as files:
+                        for entry in files:
+                            if entry.name.endswith(".tmp"):
+                                continue
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime, stat.st_size, entry.path))
+                            total += stat.st_size
+
+        removed = 0
+        if self.max_bytes is not None and total > self.max_bytes:
+            entries.sort()
+            for _, size, file_path in entries:
+                if total <= self.max_bytes * TRIM_TARGET:
+                    break
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+
+        with self.lock:
+            self.total_bytes = total
+        return removed
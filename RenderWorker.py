@@ -0,0 +1,90 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Milliseconds between checks for finished renders while any are outstanding
+RESULT_POLL_INTERVAL = 10
+
+
+class RenderWorker:
+    """Runs render jobs off the Tk thread and hands back only the result of the newest one.
+
+    Every submit gets the next generation number and makes all earlier jobs stale. Stale jobs still waiting are
+    skipped when a thread picks them up, and stale jobs that were already running have their result dropped, so
+    however fast requests come in, the callback only ever sees the latest one. Finished results go through a queue
+    that the Tk thread polls with root.after while jobs are outstanding, so callbacks always run on the Tk thread.
+
+    Two threads let the newest job start while a stale one is still finishing, PIL releases the GIL while it decodes
+    and resamples.
+    """
+
+    def __init__(self, root, workers=2):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+
+        self.generation = 0
+        self.lock = threading.Lock()
+
+        # (generation, on_done, result, error) of finished jobs, waiting for the Tk thread
+        self.results = queue.SimpleQueue()
+
+        # Jobs submitted and not yet reported back, and the pending poll
+        self.outstanding = 0
+        self.poll_job = None
+
+    def submit(self, render, on_done):
+        """Run render() in the background and call on_done(result) on the Tk thread, unless a newer job came first.
+
+        Must be called from the Tk thread. Returns the job's generation.
+        """
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        self.outstanding += 1
+        self.executor.submit(self._run, generation, render, on_done)
+        if self.poll_job is None:
+            self.poll_job = self.root.after(RESULT_POLL_INTERVAL, self.poll)
+        return generation
+
+    def cancel(self):
+        """Make every submitted job stale, used when something is shown without going through the worker."""
+        with self.lock:
+            self.generation += 1
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def _run(self, generation, render, on_done):
+        result = error = None
+        if self.is_current(generation):
+            try:
+                result = render()
+            except Exception as e:
+                error = e
+        self.results.put((generation, on_done, result, error))
+
+    def poll(self):
+        self.poll_job = None
+        latest = None
+        while True:
+            try:
+                finished = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.outstanding -= 1
+            if self.is_current(finished[0]):
+                latest = finished
+
+        if latest is not None:
+            _, on_done, result, error = latest
+            if error is not None:
+                print(f"Error rendering image: {error}")
+            else:
+                on_done(result)
+
+        if self.outstanding > 0 and self.poll_job is None:
+            self.poll_job = self.root.after(RESULT_POLL_INTERVAL, self.poll)
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,157 @@
+from PIL import Image
+
+import os
+
+
+# Plain PIL helpers shared by the display code and the background workers, nothing in here touches Tk
+
+
+def fit_size(width, height, screen_width, screen_height, zoom_level):
+    """Size an image of width x height has once scaled to fit the screen and multiplied by zoom_level."""
+    # Calculate the scaling factor to maintain the aspect ratio
+    screen_ratio = screen_width / screen_height
+    image_ratio = width / height
+
+    if image_ratio > screen_ratio:
+        # Image is wider relative to screen
+        scale_factor = screen_width / width
+    else:
+        # Image is taller relative to screen
+        scale_factor = screen_height / height
+
+    # Calculate new dimensions with zoom level
+    return int(width * scale_factor * zoom_level), int(height * scale_factor * zoom_level)
+
+
+def scale_image(image, screen_width, screen_height, zoom_level, resample=Image.LANCZOS):
+    """Resize image to fit the screen at zoom_level, maintaining the aspect ratio."""
+    image = displayable(image)
+    new_width, new_height = fit_size(image.width, image.height, screen_width, screen_height, zoom_level)
+    return image.resize((max(1, new_width), max(1, new_height)), resample)
+
+
+def load_source(path, screen_width=None, screen_height=None, zoom_level=1.0):
+    """Open and decode the image at path, returning it along with its full resolution size.
+
+    When a screen size is given, JPEGs are decoded with Pillow's draft mode at the smallest DCT scale (1/2, 1/4
+    or 1/8) that still covers the size the image will be shown at, skipping most of the decode work for large
+    camera files. Other formats are always decoded at full resolution.
+    """
+    with Image.open(path) as image:
+        original_size = image.size
+        if screen_width and screen_height:
+            width, height = fit_size(image.width, image.height, screen_width, screen_height, zoom_level)
+            image.draft(image.mode, (max(1, width), max(1, height)))
+        image.load()
+        return displayable(image), original_size
+
+
+def displayable(image):
+    """Convert palette and other exotic modes to RGBA so they can be resampled and shown with transparency."""
+    if image.mode in ("RGB", "RGBA", "L"):
+        return image
+    return image.convert("RGBA")
+
+
+def file_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def source_key(path, mtime):
+    return "source", path, mtime
+
+
+def scaled_key(path, mtime, zoom_level, screen_width, screen_height, frame=None):
+    return "scaled", path, mtime, zoom_level, screen_width, screen_height, frame
+
+
+def load_source_cached(cache, path, mtime, screen_width, screen_height, zoom_level):
+    """Return a decoded source with enough detail for zoom_level, along with the size it should be scaled to."""
+    # A zoom change only needs a new resample of the already decoded source, unless that source was decoded at
+    # a reduced scale that no longer has enough detail for the new zoom level
+    entry = cache.peek(source_key(path, mtime))
+    if entry is not None:
+        source, original_size = entry
+        target_size = fit_size(*original_size, screen_width, screen_height, zoom_level)
+        if source.size == original_size or (source.width >= target_size[0] and source.height >= target_size[1]):
+            return source, target_size
+
+    source, original_size = load_source(path, screen_width, screen_height, zoom_level)
+    cache.put(source_key(path, mtime), (source, original_size), image_size(source))
+    return source, fit_size(*original_size, screen_width, screen_height, zoom_level)
+
+
+def resize_to(image, size, resample=Image.LANCZOS):
+    # The reducing gap lets Pillow box-reduce large sources before the actual resample
+    return image.resize((max(1, size[0]), max(1, size[1])), resample, reducing_gap=3.0)
+
+
+def cached_scaled(cache, path, screen_width, screen_height, zoom_level):
+    """The high quality render of path held in cache, or None. Only looks at memory, so it is cheap on the Tk thread.
+
+    This is the lookup the cache's hit and miss counters are meant for, the display asks it once per image shown. The
+    lookups made while rendering and prefetching don't count.
+    """
+    return cache.get(scaled_key(path, file_mtime(path), zoom_level, screen_width, screen_height))
+
+
+def load_scaled(cache, path, screen_width, screen_height, zoom_level, disk_cache=None, persist=False):
+    """Return the image at path scaled for the screen, reusing the decoded and scaled bitmaps held in cache.
+
+    disk_cache, a RenderCache, is checked for a render made by an earlier run before anything is decoded. With
+    persist, a render that had to be made is also written to it in the background for the next run.
+    """
+    mtime = file_mtime(path)
+    key = scaled_key(path, mtime, zoom_level, screen_width, screen_height)
+    scaled = cache.peek(key)
+    if scaled is not None:
+        return scaled
+
+    if disk_cache is not None:
+        scaled = disk_cache.get(path, zoom_level, screen_width, screen_height)
+        if scaled is not None:
+            cache.put(key, scaled, image_size(scaled))
+            return scaled
+
+    source, target_size = load_source_cached(cache, path, mtime, screen_width, screen_height, zoom_level)
+    scaled = resize_to(source, target_size)
+    cache.put(key, scaled, image_size(scaled))
+    if persist and disk_cache is not None:
+        disk_cache.store(path, zoom_level, screen_width, screen_height, scaled)
+    return scaled
+
+
+def load_preview(cache, path, screen_width, screen_height, zoom_level, resample=Image.BILINEAR, disk_cache=None):
+    """Return (image, final) for showing while the user is still zooming or panning.
+
+    A cached high quality render, in cache or disk_cache, is returned as final. Otherwise the source is quickly
+    resampled with resample and the result is not cached, since it should be replaced by load_scaled once the input
+    stops.
+    """
+    mtime = file_mtime(path)
+    key = scaled_key(path, mtime, zoom_level, screen_width, screen_height)
+    scaled = cache.peek(key)
+    if scaled is not None:
+        return scaled, True
+
+    if disk_cache is not None:
+        scaled = disk_cache.get(path, zoom_level, screen_width, screen_height)
+        if scaled is not None:
+            cache.put(key, scaled, image_size(scaled))
+            return scaled, True
+
+    source, target_size = load_source_cached(cache, path, mtime, screen_width, screen_height, zoom_level)
+    return resize_to(source, target_size, resample), False
+
+
+def paste_position(width, height, screen_width, screen_height, panx, pany):
+    """Top left corner of a scaled image of width x height centred on the screen and offset by the pan."""
+    return (screen_width - width) // 2 + panx, (screen_height - height) // 2 + pany
+
+
+def image_size(image):
+    """Approximate number of bytes held by a decoded PIL image."""
+    return image.width * image.height * len(image.getbands())
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import pickle
+import threading
+
+from PIL import Image
+
+from Structures import IMAGE_EXTENSIONS, read_gif_metadata
+
+# Bump whenever the layout of the stored directory records changes, older index files are then rebuilt
+INDEX_VERSION = 1
+
+INDEX_DIR = "index"
+
+
+class ScanIndex:
+    """Persistent record of the directory listings under a base folder.
+
+    For every directory the index keeps its mtime, its subfolders and, for each image, the file size and mtime,
+    detected type, dimensions and GIF frame metadata. A directory whose mtime hasn't changed since it was recorded
+    is not listed again, and none of its files are opened.
+    """
+
+    def __init__(self, base_folder_path, index_dir=INDEX_DIR):
+        self.base_folder_path = os.path.abspath(base_folder_path)
+        digest = hashlib.sha1(self.base_folder_path.encode("utf-8")).hexdigest()[:12]
+        self.path = os.path.join(index_dir, f"{os.path.basename(self.base_folder_path)}-{digest}.pkl")
+
+        # directory path -> {"mtime": ns, "subdirs": [names], "files": {name: file record}}
+        self.directories = {}
+
+        # Directories looked at since the index was loaded, used to drop the ones that no longer exist
+        self.visited = set()
+
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read the index file, starting over with an empty index if it is missing, outdated or corrupted."""
+        self.directories = {}
+        self.visited = set()
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") != INDEX_VERSION or data.get("base_folder_path") != self.base_folder_path:
+                print(f"Scan index {self.path} is outdated, rebuilding")
+                self.dirty = True
+                return
+            self.directories = data["directories"]
+        except Exception as e:
+            print(f"Scan index {self.path} is unreadable, rebuilding: {e}")
+            self.dirty = True
+
+    def save(self, prune=True):
+        """Write the index if anything changed. With prune, directories that weren't visited are dropped first."""
+        with self.lock:
+            if prune:
+                for path in [path for path in self.directories if path not in self.visited]:
+                    del self.directories[path]
+                    self.dirty = True
+            if not self.dirty:
+                return
+            data = {"version": INDEX_VERSION, "base_folder_path": self.base_folder_path,
+                    "directories": self.directories}
+
+            # Write to a temporary file first so an interrupted save can't leave a truncated index behind
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.path)
+            self.dirty = False
+
+    def list_directory(self, folder_path):
+        """Return the record for folder_path, listing the directory again only if its mtime changed."""
+        folder_path = os.path.abspath(folder_path)
+        mtime = os.stat(folder_path).st_mtime_ns
+        with self.lock:
+            self.visited.add(folder_path)
+            record = self.directories.get(folder_path)
+        if record is not None and record["mtime"] == mtime:
+            return record
+
+        old_files = record["files"] if record is not None else {}
+        record = {"mtime": mtime, "subdirs": [], "files": {}}
+        record_files = record["files"]
+
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    record["subdirs"].append(entry.name)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    old = old_files.get(entry.name)
+
+                    # Files that are unchanged since the last listing keep their metadata
+                    if old is not None and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime_ns:
+                        record_files[entry.name] = old
+                    else:
+                        record_files[entry.name] = self.read_file(entry.path, stat)
+
+        with self.lock:
+            self.directories[folder_path] = record
+            self.dirty = True
+        return record
+
+    @staticmethod
+    def read_file(path, stat):
+        """Build the record of a single image file, reading only its header."""
+        file_record = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "type": "image", "width": None,
+                       "height": None, "frame_count": None, "durations": None}
+        try:
+            with Image.open(path) as image:
+                file_record["width"], file_record["height"] = image.size
+        except Exception as e:
+            print(f"Error reading header of {path}: {e}")
+
+        if path.lower().endswith(".gif"):
+            file_record["type"] = "gif"
+            try:
+                file_record["frame_count"], file_record["durations"] = read_gif_metadata(path)
+            except Exception as e:
+                print(f"Error reading GIF metadata of {path}: {e}")
+        return file_record
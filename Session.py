@@ -0,0 +1,201 @@
+import os
+import pickle
+import threading
+
+from Structures import Collection, Group
+
+# First line of every session file, older sessions are a single pickle of the whole collection graph
+SESSION_MAGIC = b"FVSESSION 1\n"
+SESSION_EXTENSION = ".session"
+
+
+def is_session_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(SESSION_MAGIC)) == SESSION_MAGIC
+
+
+def write_session(path, collections, image_record, current_group=None, image_index=0, stored_indices=None):
+    """Write the structure and metadata of collections to path, without any pixel data.
+
+    The file is the magic line, a header with the collections, the group tree and where each group's images are,
+    then one block of image records per group. image_record turns a SmartImage into the dictionary stored for it.
+    The block of current_group is written first so loading can show it before reading anything else. Virtual and
+    empty groups aren't listed, a loaded session would trim them anyway, but the ancestors of listed groups are
+    always written so the tree comes back whole, EX: a folder that only holds subfolders.
+    """
+    collection_records = []
+    groups = []
+    seen = set()
+    for collection_index, collection in enumerate(collections):
+        collection_records.append({
+            "path": collection.base_folder_path,
+            "name": collection.name,
+            "weight": collection.weight,
+            "favorite": collection.favorite,
+        })
+        for group in collection.groups:
+            if group.images and not group.virtual and group not in seen:
+                seen.add(group)
+                groups.append((collection_index, group, True))
+
+    # Ancestors that aren't listed themselves are written for the tree alone
+    for collection_index, group, _ in list(groups):
+        parent = group.parent
+        while parent is not None and parent not in seen:
+            seen.add(parent)
+            groups.append((collection_index, parent, False))
+            parent = parent.parent
+
+    positions = {group: position for position, (_, group, _) in enumerate(groups)}
+    group_records = []
+    for collection_index, group, listed in groups:
+        group_records.append({
+            "collection": collection_index,
+            "id": group.group_id,
+            "path": group.folder_path,
+            "name": group.name,
+            "weight": group.weight,
+            "favorite": group.favorite,
+            "depth": group.depth,
+            "parent": positions.get(group.parent),
+            "listed": listed,
+        })
+
+    # Blocks go in collection order, with the current group moved to the front
+    order = [position for position, (_, _, listed) in enumerate(groups) if listed]
+    current = positions.get(current_group)
+    if current not in order:
+        current = None
+    if current is not None:
+        order.remove(current)
+        order.insert(0, current)
+
+    blocks = []
+    offset = 0
+    for position in order:
+        block = pickle.dumps([image_record(image) for image in groups[position][1].images],
+                             protocol=pickle.HIGHEST_PROTOCOL)
+        group_records[position]["block"] = (offset, len(block))
+        blocks.append(block)
+        offset += len(block)
+
+    header = {
+        "collections": collection_records,
+        "groups": group_records,
+        "order": order,
+        "current": (current, image_index if current is not None else 0),
+        "stored_indices": dict(stored_indices or {}),
+    }
+
+    # Written next to the old file and swapped in, so a failed save doesn't destroy the previous session
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(SESSION_MAGIC)
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for block in blocks:
+            f.write(block)
+    os.replace(temp_path, path)
+    return len(order)
+
+
+class SessionLoader:
+    """Reads a session written by write_session, one group at a time.
+
+    open() rebuilds the collections and group tree with every group empty except the current one. Groups written only
+    to keep the tree whole are linked in but not added to any collection. The other groups are pending until hydrate()
+    fills them in, which start() does in the background in file order. Anything that needs a pending group's images
+    right away can call hydrate() itself, it is safe from any thread and only reads the group once. create_image turns a stored record back into a SmartImage.
+    """
+
+    def __init__(self, path, create_image):
+        self.path = path
+        self.create_image = create_image
+        self.file = open(path, "rb")
+        if self.file.read(len(SESSION_MAGIC)) != SESSION_MAGIC:
+            self.file.close()
+            raise ValueError(f"{path} is not a session file")
+        self.header = pickle.load(self.file)
+        self.data_start = self.file.tell()
+
+        self.collections = []
+        self.groups = []
+
+        # group -> (offset, length) of its image block, for the groups not read yet
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.done = threading.Event()
+
+    def open(self):
+        """Rebuild the collections and read the current group. Returns (collections, current group, image index)."""
+        self.collections = [Collection(record["path"], record["name"], record["weight"], record["favorite"])
+                            for record in self.header["collections"]]
+
+        for record in self.header["groups"]:
+            group = Group(record["path"], record["name"], weight=record["weight"], favorite=record["favorite"],
+                          depth=record["depth"])
+            group.group_id = record["id"]
+            self.groups.append(group)
+            if record.get("listed", True):
+                self.collections[record["collection"]].groups.append(group)
+                self.pending[group] = record["block"]
+
+        # Parents can come after their children, ancestors kept for the tree alone are written last
+        for group, record in zip(self.groups, self.header["groups"]):
+            if record["parent"] is not None:
+                group.parent = self.groups[record["parent"]]
+                group.parent.children.append(group)
+
+        current, image_index = self.header["current"]
+        current_group = self.groups[current] if current is not None else None
+        if current_group is not None:
+            self.hydrate(current_group)
+        if not self.pending:
+            self.done.set()
+        return self.collections, current_group, image_index
+
+    @property
+    def stored_indices(self):
+        return self.header["stored_indices"]
+
+    def is_pending(self, group):
+        return group in self.pending
+
+    def hydrate(self, group):
+        """Read the images of group if they haven't been read yet."""
+        with self.lock:
+            block = self.pending.get(group)
+            if block is None or self.file.closed:
+                return
+            offset, length = block
+            self.file.seek(self.data_start + offset)
+            records = pickle.loads(self.file.read(length))
+            group.images = [self.create_image(record, record["path"]) for record in records]
+            del self.pending[group]
+            if not self.pending:
+                self.done.set()
+
+    def hydrate_all(self):
+        for group in self.groups:
+            self.hydrate(group)
+
+    def start(self):
+        """Hydrate the remaining groups on a background thread, in the order they were written."""
+        if self.done.is_set() or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        for position in self.header["order"]:
+            if self.stopped.is_set():
+                return
+            self.hydrate(self.groups[position])
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self.file.close()
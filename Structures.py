@@ -1,15 +1,120 @@
 from PIL import Image, ImageSequence
 
 import os
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
+import Renderer
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+# Number of directories scanned at the same time, most of the time is spent waiting on the filesystem
+SCAN_WORKERS = 16
+
+# Default amount of memory decoded GIF frames may use before the least recently shown GIFs are released
+GIF_FRAME_BUDGET_BYTES = 512 * 1024 * 1024
+
+# Shared by every image without tags or a preconfig, both are immutable tuples so one instance can be shared
+EMPTY = ()
+
+
+def intern_tags(tags):
+    """Return tags as a tuple of interned strings, so a tag used on many images is only stored once."""
+    if not tags:
+        return EMPTY
+    return tuple(sys.intern(tag) for tag in tags)
+
+
+def slot_names(cls):
+    """Every slot declared by cls and its bases."""
+    return [name for klass in reversed(cls.__mro__) for name in getattr(klass, '__slots__', ())]
+
+
+class SlotState:
+    """Pickling for slotted classes that also accepts state pickled when the classes still had a __dict__.
+
+    Old pickles carry a plain attribute dictionary, attributes missing from it are filled in with the class's
+    defaults and attributes that no longer exist are ignored.
+    """
+
+    __slots__ = ()
+
+    # Attributes that hold caches and are never pickled
+    transient = ()
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in slot_names(type(self))
+                if name not in self.transient and hasattr(self, name)}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # (dict state, slot state) as produced by the default reduce
+            state = {**(state[0] or {}), **(state[1] or {})}
+        for name, value in self.state_defaults().items():
+            setattr(self, name, state.get(name, value))
+
+    def state_defaults(self):
+        return {}
+
+
+class DirtyTracker:
+    """Collects the SmartImages and Groups whose saved metadata changed since they were last written."""
+
+    def __init__(self):
+        self.pending = set()
+        self.lock = threading.Lock()
+
+        # Called with every marked object, for structures that mirror the metadata such as the Catalog
+        self.listeners = []
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def mark(self, obj):
+        with self.lock:
+            obj.dirty = True
+            self.pending.add(obj)
+        for callback in self.listeners:
+            callback(obj)
+
+    def drain(self):
+        """Return everything marked since the last drain and clear the marks.
+
+        Objects changed again after this returns are marked anew and picked up by the next drain.
+        """
+        with self.lock:
+            pending = list(self.pending)
+            self.pending.clear()
+            for obj in pending:
+                obj.dirty = False
+        return pending
+
+    def discard(self, objects):
+        """Clear the marks of objects that were just written some other way."""
+        with self.lock:
+            for obj in objects:
+                obj.dirty = False
+                self.pending.discard(obj)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+
+class SmartImage(SlotState):
+    # Large libraries hold hundreds of thousands of these, slots keep each one small
+    __slots__ = ('path', 'name', 'group', 'default_zoom_level', 'zoom_level', 'default_panx', 'default_pany', 'panx',
+                 'pany', 'series', 'index', 'offset', 'weight', 'tags', 'favorite', 'preconfig', 'dirty')
 
-class SmartImage:
     def __init__(self, path, name, group, default_zoom_level=1.0, default_panx=0, default_pany=0, series="", index=0,
                  offset=None, weight=1.0, tags=None, favorite=False, preconfig=None):
-        if preconfig is None:
-            preconfig = []
-        if tags is None:
-            tags = []
         self.path = path
         self.name = name
         self.group = group  # Reference to the parent group
@@ -32,26 +137,61 @@ class SmartImage:
         # Rarity modifier for when true random draw is used 
         self.weight = weight
 
-        # Strings for assisting indexing
-        self.tags = tags
+        # Strings for assisting indexing, kept as a tuple of interned strings
+        self.tags = intern_tags(tags)
         self.favorite = favorite
 
-        # A preconfig list that has the first 2 values represent panx and y, then the 3rd represent a zoom
-        self.preconfig = preconfig
+        # A preconfig tuple that has the first 2 values represent panx and y, then the 3rd represent a zoom
+        self.preconfig = tuple(preconfig) if preconfig else EMPTY
+
+        # Set by mark_dirty until the autosaver has written the image
+        self.dirty = False
+
+    def state_defaults(self):
+        return {'path': None, 'name': None, 'group': None, 'default_zoom_level': 1.0, 'zoom_level': 1.0,
+                'default_panx': 0, 'default_pany': 0, 'panx': 0, 'pany': 0, 'series': "", 'index': 0, 'offset': None,
+                'weight': 1.0, 'tags': EMPTY, 'favorite': False, 'preconfig': EMPTY, 'dirty': False}
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        # Older pickles hold lists here
+        self.tags = intern_tags(self.tags)
+        self.preconfig = tuple(self.preconfig) if self.preconfig else EMPTY
+
+    def update_from(self, other):
+        """Copy every saved attribute of other onto this image, used to apply stored metadata to a loaded image."""
+        self.__setstate__(other.__getstate__())
+
+    def mark_dirty(self):
+        """Queue the image's metadata to be written by the next autosave."""
+        dirty_tracker.mark(self)
 
     def add_tag(self, tags):
+        """Add the comma separated tags, returning the ones the image didn't already have."""
+        added = []
         for tag in tags.split(','):
             tag = tag.strip()
             tag = tag.lower()
             if tag and tag not in self.tags:
-                self.tags.append(tag)
+                tag = sys.intern(tag)
+                self.tags += (tag,)
+                added.append(tag)
+        if added:
+            self.mark_dirty()
+        return added
 
     def remove_tag(self, tags):
+        """Remove the comma separated tags, returning the ones the image actually had."""
+        removed = []
         for tag in tags.split(','):
             tag = tag.strip()
             tag = tag.lower()
             if tag in self.tags:
-                self.tags.remove(tag)
+                self.tags = intern_tags([t for t in self.tags if t != tag])
+                removed.append(tag)
+        if removed:
+            self.mark_dirty()
+        return removed
 
     # Debug Only
     def print_tags(self):
@@ -60,10 +200,16 @@ class SmartImage:
 
     def set_zoom_level(self, zoom_level):
         self.default_zoom_level = zoom_level
+        self.mark_dirty()
 
     def set_pan(self, panx, pany):
         self.default_panx = panx
         self.default_pany = pany
+        self.mark_dirty()
+
+    def set_preconfig(self, panx, pany, zoom_level):
+        self.preconfig = (panx, pany, zoom_level)
+        self.mark_dirty()
 
     def reset_zoom_pan(self):
         self.zoom_level = self.default_zoom_level
@@ -83,14 +229,16 @@ class SmartImage:
         if index is not None:
             self.index = index
         if tags is not None:
-            self.tags = tags
+            self.tags = intern_tags(tags)
         if favorite is not None:
             self.favorite = favorite
         if weight is not None:
             self.weight = weight
+        self.mark_dirty()
 
     def toggle_favorite(self):
         self.favorite = not self.favorite
+        self.mark_dirty()
 
     def __repr__(self):
         return (f"SmartImage(name={self.name}, path={self.path}, group={self.group}, zoom_level={self.zoom_level}, "
@@ -98,8 +246,12 @@ class SmartImage:
                 f"offset={self.offset}, tags={self.tags}, favorite={self.favorite}, weight={self.weight})")
 
 
-class Group:
-    def __init__(self, folder_path, name, weight=1.0, favorite=False, images=None, parent=None, depth=0):
+class Group(SlotState):
+    __slots__ = ('folder_path', 'name', 'weight', 'favorite', 'images', 'parent', 'children', 'depth', 'dirty',
+                 'virtual', 'group_id')
+
+    def __init__(self, folder_path, name, weight=1.0, favorite=False, images=None, parent=None, depth=0,
+                 virtual=False):
         if images is None:
             images = []
         self.folder_path = folder_path
@@ -111,6 +263,38 @@ class Group:
         self.children = []
         self.depth = depth
 
+        # Set by mark_dirty until the autosaver has written the group
+        self.dirty = False
+
+        # Virtual groups, such as tag query results, hold images that belong to other groups and aren't saved
+        self.virtual = virtual
+
+        # Unique for the lifetime of the group, unlike the name which folders in different subtrees can share
+        self.group_id = uuid.uuid4().hex
+
+    def state_defaults(self):
+        return {'folder_path': None, 'name': None, 'weight': 1.0, 'favorite': False, 'images': [], 'parent': None,
+                'children': [], 'depth': 0, 'dirty': False, 'virtual': False, 'group_id': None}
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        # Sessions saved before groups had ids
+        if self.group_id is None:
+            self.group_id = uuid.uuid4().hex
+
+    def mark_dirty(self):
+        """Queue the group's weight and favorite to be written by the next autosave."""
+        if not self.virtual:
+            dirty_tracker.mark(self)
+
+    def set_weight(self, weight):
+        self.weight = weight
+        self.mark_dirty()
+
+    def set_favorite(self, favorite):
+        self.favorite = favorite
+        self.mark_dirty()
+
     def add_image(self, image):
         """Add a SmartImage to the group."""
         if isinstance(image, SmartImage):
@@ -123,24 +307,46 @@ class Group:
             child_group.depth = self.depth + 1
             self.children.append(child_group)
 
-    def load_images(self, folder_path=None):
+    def load_images(self, folder_path=None, workers=SCAN_WORKERS, index=None):
         """Recursively load images from the given folder path and nested subfolders."""
+        for _ in DirectoryScanner(workers, index).scan([self], {self: folder_path} if folder_path else None):
+            pass
+
+    def scan_directory(self, folder_path=None, index=None):
+        """Load the images directly inside the folder and create a child group for each subfolder.
+
+        Subfolders are not descended into, the new child groups are returned so the caller can scan them. With a
+        ScanIndex, unchanged directories are taken from the index instead of the filesystem.
+        """
         if folder_path is None:
             folder_path = self.folder_path
 
-        for item in os.listdir(folder_path):
-            item_path = os.path.join(folder_path, item)
-            if os.path.isdir(item_path):
-                child_group = Group(item_path, item, parent=self, depth=self.depth + 1)
-                self.add_child_group(child_group)
-                child_group.load_images(item_path)
-            elif item.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                if item.lower().endswith('.gif'):
-                    with Image.open(item_path) as gif:
-                        animation_speed = gif.info.get('duration', 100)  # Use a default value if 'duration' is missing
-                    self.add_image(GifImage(item_path, item, group=self.name, animation_speed=animation_speed))
+        if index is not None:
+            record = index.list_directory(folder_path)
+            for name in record["subdirs"]:
+                self.add_child_group(Group(os.path.join(folder_path, name), name, parent=self, depth=self.depth + 1))
+            for name, file_record in record["files"].items():
+                path = os.path.join(folder_path, name)
+                if file_record["type"] == "gif":
+                    durations = list(file_record["durations"] or [])
+                    self.add_image(GifImage(path, name, group=self.name, durations=durations,
+                                            frame_count=file_record["frame_count"]))
                 else:
-                    self.add_image(SmartImage(item_path, item, group=self.name))
+                    self.add_image(SmartImage(path, name, group=self.name))
+            return self.children
+
+        # scandir entries carry their type, so no extra stat is needed per entry on most filesystems
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    self.add_child_group(Group(entry.path, entry.name, parent=self, depth=self.depth + 1))
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    if entry.name.lower().endswith('.gif'):
+                        # Only the frame count and durations are read here, frames are decoded when first displayed
+                        self.add_image(GifImage(entry.path, entry.name, group=self.name))
+                    else:
+                        self.add_image(SmartImage(entry.path, entry.name, group=self.name))
+        return self.children
 
     def __repr__(self):
         return (
@@ -163,31 +369,37 @@ class Collection:
         if isinstance(group, Group):
             self.groups.append(group)
 
-    def load_groups(self, whitelist=None, blacklist=None):
-        """Load groups from the base folder path."""
-        # print(f"Loading groups from {self.base_folder_path}")
-        for folder_name in os.listdir(self.base_folder_path):
-            folder_path = os.path.join(self.base_folder_path, folder_name)
-            # print(f"Checking folder: {folder_path}")
-
-            if os.path.isdir(folder_path):
-                # print(f"Found directory: {folder_path}")
-
-                # Check whitelist and blacklist
-                if (whitelist and folder_name not in whitelist) or (blacklist and folder_name in blacklist):
-                    print(f"Skipping folder {folder_name} due to whitelist/blacklist")
-                    continue
+    def load_groups(self, whitelist=None, blacklist=None, on_group=None, workers=SCAN_WORKERS, index=None):
+        """Load groups from the base folder path.
 
-                # Create a new Group for each subfolder in the base folder
-                group = Group(folder_path, folder_name)
-                # Load images and subfolders for each group
-                group.load_images()
-                self.add_group(group)
-                self.add_child_groups(group)
-                print(f"Group added: {folder_name} with {len(group.images)} images")
-
-            #else:
-            #print(f"Not a directory: {folder_path}")
+        Folders are scanned in parallel. on_group, if given, is called with each top level group as soon as it and
+        all of its nested groups are loaded, the collection itself keeps the order the folders were listed in. An
+        optional ScanIndex lets directories that haven't changed since the last scan be skipped.
+        """
+        if index is not None:
+            folder_names = index.list_directory(self.base_folder_path)["subdirs"]
+        else:
+            with os.scandir(self.base_folder_path) as entries:
+                folder_names = [entry.name for entry in entries if entry.is_dir()]
+
+        top_groups = []
+        for folder_name in folder_names:
+            # Check whitelist and blacklist
+            if (whitelist and folder_name not in whitelist) or (blacklist and folder_name in blacklist):
+                print(f"Skipping folder {folder_name} due to whitelist/blacklist")
+                continue
+
+            # Create a new Group for each subfolder in the base folder
+            top_groups.append(Group(os.path.join(self.base_folder_path, folder_name), folder_name))
+
+        for group in DirectoryScanner(workers, index).scan(top_groups):
+            print(f"Group added: {group.name} with {len(group.images)} images")
+            if on_group:
+                on_group(group)
+
+        for group in top_groups:
+            self.add_group(group)
+            self.add_child_groups(group)
 
     def add_child_groups(self, group):
         """Add child groups recursively."""
@@ -195,41 +407,177 @@ class Collection:
             self.groups.append(child_group)
             self.add_child_groups(child_group)
 
+    def filtered(self, whitelist=None, blacklist=None):
+        """Return a new Collection with only the groups allowed by whitelist and blacklist, lists of group names.
+
+        Names are matched at any depth, so a nested folder can be whitelisted on its own, and blacklisting a folder
+        drops everything under it. See group_included.
+        """
+        filtered_collection = Collection(self.base_folder_path, self.name)
+        kept = set()
+        for group in self.groups:
+            if group_included(group, whitelist, blacklist) and group not in kept:
+                kept.add(group)
+                filtered_collection.add_group(group)
+            else:
+                self._filter_group_recursive(group, filtered_collection, kept, whitelist, blacklist)
+        return filtered_collection
+
+    def _filter_group_recursive(self, group, filtered_collection, kept, whitelist, blacklist):
+        for child in group.children:
+            # The flat group list also holds nested groups, so a child can be reached more than once
+            if group_included(child, whitelist, blacklist) and child not in kept:
+                kept.add(child)
+                filtered_collection.add_group(child)
+            self._filter_group_recursive(child, filtered_collection, kept, whitelist, blacklist)
+
     def __repr__(self):
         return (f"Collection(name={self.name}, base_folder_path={self.base_folder_path}, weight={self.weight}, "
                 f"favorite={self.favorite}, groups={len(self.groups)})")
 
 
+def group_included(group, whitelist, blacklist):
+    """Whether group passes the whitelist and blacklist, lists of group names that may be empty or None.
+
+    A whitelisted group is always included. Otherwise a group is excluded if it or any of its parents is blacklisted,
+    and when there is a whitelist, every group not on it is excluded.
+    """
+    if whitelist and group.name in whitelist:
+        print(f"{group.name} was found in whitelist\n")
+        return True
+
+    # Check if the group or any of its parents are in the blacklist
+    current_group = group
+    while current_group:
+        if blacklist and current_group.name in blacklist:
+            return False
+        current_group = current_group.parent
+
+    # Return False if there is a whitelist present, True if not
+    return not whitelist
+
+
 class GifImage(SmartImage):
+    __slots__ = ('frames', 'derived', 'durations', 'frame_count', 'current_frame', 'animation', 'animation_speed',
+                 'is_animated', 'is_paused')
+
+    # Decoded frames are a cache and are never pickled
+    transient = ('frames', 'derived')
+
     def __init__(self, path, name, group, default_zoom_level=1.0, default_panx=0, default_pany=0, series="", index=0,
-                 offset=None, weight=1.0, tags=None, favorite=False, preconfig=None, durations=None, animation_speed=100):
+                 offset=None, weight=1.0, tags=None, favorite=False, preconfig=None, durations=None,
+                 animation_speed=None, frame_count=None):
         super().__init__(path, name, group, default_zoom_level, default_panx, default_pany, series, index, offset,
                          weight, tags, favorite, preconfig)
         if durations is None:
             durations = []
-        if preconfig is None:
-            preconfig = []
-        if tags is None:
-            tags = []
-        self.frames = []
+
+        # Decoded source frames, empty until the GIF is first displayed (see load_gif_frames). These are never
+        # modified, scaled copies live in the derived frame set
+        self.frames = EMPTY
+
+        # (key, frames) with the frames scaled for a single (zoom level, screen width, screen height)
+        self.derived = None
         self.durations = durations
+        self.frame_count = frame_count if frame_count is not None else len(durations)
         self.current_frame = 0
         self.animation = None
         self.animation_speed = animation_speed  # Speed in ms
         self.is_animated = True
         self.is_paused = False
-        self.load_gif_frames()
+
+        # Saved data already carries the durations, so the file only needs reading for new GIFs
+        if not self.durations:
+            self.load_gif_metadata()
+        if self.animation_speed is None:
+            self.animation_speed = self.durations[0] if self.durations else 100
+
+    def state_defaults(self):
+        return {**super().state_defaults(), 'durations': [], 'frame_count': 0, 'current_frame': 0, 'animation': None,
+                'animation_speed': 100, 'is_animated': True, 'is_paused': False}
+
+    def __setstate__(self, state):
+        # Restoring over a live GIF (update_from) drops its frames, the budget has to stop counting them
+        gif_frame_budget.forget(self)
+        if isinstance(state, dict) and 'frame_count' not in state:
+            # Sessions saved before frames were loaded lazily contain decoded frames and no frame count
+            state = dict(state, frame_count=len(state.get('frames') or state.get('durations') or []))
+        super().__setstate__(state)
+        self.frames = EMPTY
+        self.derived = None
+
+    def load_gif_metadata(self):
+        """Read the frame count and frame durations without decoding any frames."""
+        try:
+            self.frame_count, self.durations = read_gif_metadata(self.path)
+        except Exception as e:
+            print(f"Error reading GIF metadata: {e}")
 
     def load_gif_frames(self):
+        """Decode all frames if they aren't in memory already and register them with the frame budget."""
+        if self.frames:
+            gif_frame_budget.touch(self, self.frames_size())
+            return self.frames
+
+        frames = []
         try:
             with Image.open(self.path) as img:
-                for i, frame in enumerate(ImageSequence.Iterator(img)):
-                    frame_copy = frame.copy()
-                    self.frames.append(frame_copy)
-                    duration = img.info.get('duration', 100)  # Default duration if not specified
-                    self.durations.append(duration)
+                for frame in ImageSequence.Iterator(img):
+                    frames.append(frame.copy())
         except Exception as e:
             print(f"Error loading GIF: {e}")
+            return self.frames
+
+        # Keep the durations in step with what was actually decoded
+        if len(self.durations) < len(frames):
+            self.durations = self.durations + [100] * (len(frames) - len(self.durations))
+        self.frame_count = len(frames)
+        self.frames = frames
+        gif_frame_budget.touch(self, self.frames_size())
+        return self.frames
+
+    def release_frames(self):
+        """Drop the decoded frames, they will be decoded again the next time they are needed."""
+        self.frames = EMPTY
+        self.derived = None
+        gif_frame_budget.forget(self)
+
+    def get_derived_frames(self, zoom_level, screen_width, screen_height):
+        """Return the frames scaled for zoom_level and the screen size, or None if they haven't been built."""
+        derived = self.derived
+        if derived is not None and derived[0] == (zoom_level, screen_width, screen_height):
+            return derived[1]
+        return None
+
+    def resize_frames(self, zoom_level, screen_width, screen_height):
+        """Build the derived frame set for zoom_level from the source frames, which are left untouched.
+
+        Only one derived set is kept, building one for another zoom level replaces it. This is safe to run on a
+        worker thread.
+        """
+        frames = self.get_derived_frames(zoom_level, screen_width, screen_height)
+        if frames is not None:
+            return frames
+
+        frames = [Renderer.scale_image(frame, screen_width, screen_height, zoom_level)
+                  for frame in self.load_gif_frames()]
+        self.derived = ((zoom_level, screen_width, screen_height), frames)
+        gif_frame_budget.touch(self, self.frames_size())
+        return frames
+
+    def release_derived_frames(self):
+        """Drop the scaled frames, used once the GIF is no longer being shown."""
+        if self.derived is not None:
+            self.derived = None
+            gif_frame_budget.update(self, self.frames_size())
+
+    def frames_size(self):
+        """Approximate number of bytes used by the source and derived frames."""
+        frames = list(self.frames)
+        derived = self.derived
+        if derived is not None:
+            frames += derived[1]
+        return sum(Renderer.image_size(frame) for frame in frames)
 
     def play(self):
         self.is_animated = True
@@ -245,17 +593,21 @@ class GifImage(SmartImage):
 
     def set_animation_speed(self, speed):
         self.animation_speed = speed
+        self.mark_dirty()
 
     def set_all_frame_durations(self, duration):
-        self.durations = [duration] * len(self.frames)
+        self.durations = [duration] * self.frame_count
+        self.mark_dirty()
         print(f"All frame durations set to {duration} ms")
 
     def increase_frame_durations(self, increment):
         self.durations = [d + increment for d in self.durations]
+        self.mark_dirty()
         print(f"Increased all frame durations by {increment} ms")
 
     def decrease_frame_durations(self, decrement):
         self.durations = [max(10, d - decrement) for d in self.durations]  # Ensure duration is at least 10 ms
+        self.mark_dirty()
         print(f"Decreased all frame durations by {decrement} ms")
 
     def get_next_frame_duration(self):
@@ -263,21 +615,183 @@ class GifImage(SmartImage):
         print(f"Next frame duration: {duration} ms for frame {self.current_frame}")
         return duration
 
-    def resize_frames(self):
-        # Resize all frames according to the current zoom level
-        for i in range(len(self.frames)):
-            frame = self.frames[i]
-            zoom_level = self.zoom_level
 
-            screen_ratio = self.screen_width / self.screen_height
-            image_ratio = frame.width / frame.height
+class DirectoryScanner:
+    """Scans folder trees into Groups, listing many directories at once on a thread pool."""
 
-            if image_ratio > screen_ratio:
-                scale_factor = self.screen_width / frame.width
-            else:
-                scale_factor = self.screen_height / frame.height
+    def __init__(self, workers=SCAN_WORKERS, index=None):
+        self.workers = workers
 
-            new_width = int(frame.width * scale_factor * zoom_level)
-            new_height = int(frame.height * scale_factor * zoom_level)
+        # Optional ScanIndex shared by all directory jobs
+        self.index = index
 
-            self.frames[i] = frame.resize((new_width, new_height), Image.LANCZOS)
+    def scan(self, groups, folder_paths=None):
+        """Scan every group's folder tree, yielding each of the given groups once its whole tree is loaded.
+
+        Each directory is its own job, so large subtrees are spread over all workers. folder_paths optionally maps a
+        group to the folder to scan instead of its folder_path.
+        """
+        if not groups:
+            return
+        folder_paths = folder_paths or {}
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scan") as executor:
+            # future -> (group being scanned, top level group it belongs to)
+            pending = {}
+
+            # Number of directories still to scan under each top level group
+            remaining = {}
+
+            for group in groups:
+                remaining[group] = 1
+                future = executor.submit(self._scan_one, group, folder_paths.get(group), self.index)
+                pending[future] = (group, group)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    group, top_group = pending.pop(future)
+                    for child_group in future.result():
+                        remaining[top_group] += 1
+                        child_future = executor.submit(self._scan_one, child_group, None, self.index)
+                        pending[child_future] = (child_group, top_group)
+
+                    remaining[top_group] -= 1
+                    if remaining[top_group] == 0:
+                        yield top_group
+
+    @staticmethod
+    def _scan_one(group, folder_path=None, index=None):
+        try:
+            return group.scan_directory(folder_path, index)
+        except OSError as e:
+            print(f"Error scanning {folder_path or group.folder_path}: {e}")
+            return []
+
+
+class GifFrameBudget:
+    """Keeps decoded GIF frames within a memory budget by releasing the least recently shown GIFs first."""
+
+    def __init__(self, max_bytes=GIF_FRAME_BUDGET_BYTES):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+
+        # GifImage -> bytes of decoded frames, ordered from least to most recently used
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+
+        # GIF on screen, never released however old its last touch is
+        self.pinned = None
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.enforce()
+
+    def touch(self, gif_image, size):
+        """Mark gif_image as the most recently used GIF, holding size bytes of frames."""
+        with self.lock:
+            self.used_bytes -= self.loaded.pop(gif_image, 0)
+            self.loaded[gif_image] = size
+            self.used_bytes += size
+        self.enforce(keep=gif_image)
+
+    def update(self, gif_image, size):
+        """Change the recorded size of gif_image without marking it as recently used."""
+        with self.lock:
+            if gif_image in self.loaded:
+                self.used_bytes += size - self.loaded[gif_image]
+                self.loaded[gif_image] = size
+
+    def forget(self, gif_image):
+        with self.lock:
+            self.used_bytes -= self.loaded.pop(gif_image, 0)
+
+    def pin(self, gif_image):
+        """Protect gif_image from being released, replacing any earlier pin. None removes the pin."""
+        with self.lock:
+            self.pinned = gif_image
+
+    def enforce(self, keep=None):
+        """Release GIFs, oldest first, until the budget is met. The GIF passed as keep and the pinned GIF are never
+        released."""
+        while True:
+            with self.lock:
+                if self.used_bytes <= self.max_bytes:
+                    return
+                victim = next((gif for gif in self.loaded if gif is not keep and gif is not self.pinned), None)
+            if victim is None:
+                return
+            victim.release_frames()
+
+
+# Shared by every GifImage, use set_max_bytes to configure
+gif_frame_budget = GifFrameBudget()
+
+# Shared by every SmartImage and Group, drained by the autosaver
+dirty_tracker = DirtyTracker()
+
+
+def read_gif_metadata(path):
+    """Return the frame count and per-frame durations (ms) of a GIF by walking its blocks without decoding."""
+    try:
+        return _parse_gif_blocks(path)
+    except (ValueError, IndexError):
+        # Fall back to Pillow for anything the block walker doesn't understand
+        durations = []
+        with Image.open(path) as img:
+            for frame in ImageSequence.Iterator(img):
+                durations.append(frame.info.get('duration', 100))
+        return len(durations), durations
+
+
+def _parse_gif_blocks(path):
+    durations = []
+    with open(path, 'rb') as f:
+        header = f.read(13)
+        if len(header) < 13 or header[:3] != b'GIF':
+            raise ValueError(f"Not a GIF file: {path}")
+
+        # Skip the global color table if there is one
+        flags = header[10]
+        if flags & 0x80:
+            f.seek(3 * (2 << (flags & 0x07)), os.SEEK_CUR)
+
+        duration = None
+        while True:
+            introducer = f.read(1)
+            if not introducer or introducer == b';':
+                break
+            if introducer == b'!':
+                label = f.read(1)
+                block = _read_sub_blocks(f)
+                if label == b'\xf9' and len(block) >= 3:
+                    # Graphic control extension, delay is stored in hundredths of a second
+                    duration = int.from_bytes(block[1:3], 'little') * 10
+            elif introducer == b',':
+                descriptor = f.read(9)
+                if len(descriptor) < 9:
+                    raise ValueError(f"Truncated image descriptor in {path}")
+                if descriptor[8] & 0x80:
+                    f.seek(3 * (2 << (descriptor[8] & 0x07)), os.SEEK_CUR)
+                f.read(1)  # LZW minimum code size
+                _read_sub_blocks(f, keep=False)
+                durations.append(duration if duration is not None else 100)
+                duration = None
+            else:
+                raise ValueError(f"Unexpected block {introducer!r} in {path}")
+
+    if not durations:
+        raise ValueError(f"No frames found in {path}")
+    return len(durations), durations
+
+
+def _read_sub_blocks(f, keep=True):
+    data = bytearray()
+    while True:
+        size = f.read(1)
+        if not size or size[0] == 0:
+            return bytes(data)
+        if keep:
+            data += f.read(size[0])
+        else:
+            f.seek(size[0], os.SEEK_CUR)
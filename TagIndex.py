@@ -0,0 +1,204 @@
+import bisect
+import re
+
+from Structures import Group
+
+# Parentheses, quoted tags (which may contain spaces) and bare words
+TOKEN_PATTERN = re.compile(r'\(|\)|"[^"]*"|[^\s()"]+')
+
+KEYWORDS = {"and", "or", "not"}
+
+
+class TagIndex:
+    """Inverted index from tag to the ids of the images carrying it.
+
+    Image ids are assigned in the order images are added, so results can be returned in library order. The index
+    is kept current by calling add and remove with the tags SmartImage.add_tag and remove_tag report as changed.
+
+    Queries are tags combined with AND, OR, NOT and parentheses, EX: 'cat AND (sky OR "blue sea") NOT dog'. Terms
+    next to each other are ANDed and a trailing * matches every tag starting with the prefix, EX: 'anim*'.
+    """
+
+    def __init__(self, groups=()):
+        self.images = []
+        self.ids = {}
+
+        # tag -> set of image ids, and every tag in sorted order for prefix lookups
+        self.postings = {}
+        self.sorted_tags = []
+
+        for group in groups:
+            if group.virtual:
+                continue
+            for image in group.images:
+                self.add_image(image)
+
+    def add_image(self, image):
+        if image in self.ids:
+            return
+        self.ids[image] = len(self.images)
+        self.images.append(image)
+        self.add(image, image.tags)
+
+    def add(self, image, tags):
+        image_id = self.ids.get(image)
+        if image_id is None:
+            return
+        for tag in tags:
+            posting = self.postings.get(tag)
+            if posting is None:
+                posting = self.postings[tag] = set()
+                bisect.insort(self.sorted_tags, tag)
+            posting.add(image_id)
+
+    def remove(self, image, tags):
+        image_id = self.ids.get(image)
+        if image_id is None:
+            return
+        for tag in tags:
+            posting = self.postings.get(tag)
+            if posting is None:
+                continue
+            posting.discard(image_id)
+            if not posting:
+                del self.postings[tag]
+                del self.sorted_tags[bisect.bisect_left(self.sorted_tags, tag)]
+
+    def tags_with_prefix(self, prefix):
+        start = bisect.bisect_left(self.sorted_tags, prefix)
+        end = start
+        while end < len(self.sorted_tags) and self.sorted_tags[end].startswith(prefix):
+            end += 1
+        return self.sorted_tags[start:end]
+
+    def lookup(self, term):
+        """Ids of the images matching a single term, a tag or a prefix ending in *."""
+        if term.endswith("*"):
+            ids = set()
+            for tag in self.tags_with_prefix(term[:-1]):
+                ids |= self.postings[tag]
+            return ids
+        return self.postings.get(term, set())
+
+    def count(self, tag):
+        return len(self.postings.get(tag, ()))
+
+    def query(self, text):
+        """Return the images matching the query text, in the order they were added.
+
+        Raises ValueError if the query can't be parsed.
+        """
+        ids, negated = QueryParser(text, self).parse()
+        if not negated:
+            return [self.images[image_id] for image_id in sorted(ids)]
+
+        # Everything except ids, copied as the runs of images between the excluded ones
+        results = []
+        start = 0
+        for image_id in sorted(ids):
+            results += self.images[start:image_id]
+            start = image_id + 1
+        results += self.images[start:]
+        return results
+
+    def query_group(self, text):
+        """Run a query and wrap the results in a virtual Group that can be opened like any other group."""
+        return Group(None, f"Query: {text}", images=self.query(text), virtual=True)
+
+
+class QueryParser:
+    """Recursive descent parser that evaluates a tag query against a TagIndex as it parses.
+
+    Every sub-expression evaluates to (ids, negated). A negated result stands for every image except ids, which
+    lets NOT combine with AND and OR through set differences without building the set of all images.
+    """
+
+    def __init__(self, text, index):
+        self.tokens = TOKEN_PATTERN.findall(text)
+        self.position = 0
+        self.index = index
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty query")
+        result = self.parse_or()
+        if self.position < len(self.tokens):
+            raise ValueError(f"Unexpected '{self.tokens[self.position]}' in query")
+        return result
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def peek_keyword(self):
+        token = self.peek()
+        if token is not None and token.lower() in KEYWORDS:
+            return token.lower()
+        return None
+
+    def parse_or(self):
+        left = self.parse_and()
+        while self.peek_keyword() == "or":
+            self.position += 1
+            left = union(left, self.parse_and())
+        return left
+
+    def parse_and(self):
+        left = self.parse_not()
+        while True:
+            keyword = self.peek_keyword()
+            if keyword == "and":
+                self.position += 1
+            elif self.peek() is None or self.peek() == ")" or keyword == "or":
+                return left
+            # Anything else is an implicit AND
+            left = intersection(left, self.parse_not())
+
+    def parse_not(self):
+        if self.peek_keyword() == "not":
+            self.position += 1
+            ids, negated = self.parse_not()
+            return ids, not negated
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("Query ends unexpectedly")
+        self.position += 1
+
+        if token == "(":
+            result = self.parse_or()
+            if self.peek() != ")":
+                raise ValueError("Missing ')' in query")
+            self.position += 1
+            return result
+        if token == ")" or token.lower() in KEYWORDS:
+            raise ValueError(f"Unexpected '{token}' in query")
+
+        # Tags are stored stripped and lower case
+        term = token[1:-1] if token.startswith('"') else token
+        return self.index.lookup(term.strip().lower()), False
+
+
+def intersection(left, right):
+    (left_ids, left_negated), (right_ids, right_negated) = left, right
+    if not left_negated and not right_negated:
+        return left_ids & right_ids, False
+    if left_negated and right_negated:
+        return left_ids | right_ids, True
+    if left_negated:
+        return right_ids - left_ids, False
+    return left_ids - right_ids, False
+
+
+def union(left, right):
+    (left_ids, left_negated), (right_ids, right_negated) = left, right
+    if not left_negated and not right_negated:
+        return left_ids | right_ids, False
+    if left_negated and right_negated:
+        return left_ids & right_ids, True
+    if left_negated:
+        return left_ids - right_ids, True
+    return right_ids - left_ids, True
@@ -0,0 +1,236 @@
+import hashlib
+import math
+import mmap
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from Renderer import file_mtime
+
+# Width and height of every thumbnail, smaller images are centred on a transparent square
+THUMBNAIL_SIZE = 128
+
+ATLAS_DIRECTORY = "thumbnails"
+
+# Worker processes used to decode images into thumbnails, and how many paths each one is handed at a time
+THUMBNAIL_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+THUMBNAIL_CHUNK_SIZE = 8
+
+# The atlas file grows by segments of at least this many slots, each mapped on its own
+SEGMENT_SLOTS = 256
+
+# The index is written out every this many new thumbnails while generating, so an interrupted run keeps its work
+INDEX_SAVE_INTERVAL = 500
+
+
+def atlas_name(collection_path):
+    """File name shared by the atlas and index of the collection rooted at collection_path."""
+    return hashlib.sha1(os.path.abspath(collection_path).encode("utf-8")).hexdigest()[:16]
+
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE):
+    """Decode path into a size x size RGBA thumbnail. Returns (path, mtime, bytes), bytes is None if it failed.
+
+    Runs in the worker processes, so it only uses plain PIL. Image.thumbnail decodes JPEGs in draft mode, so large
+    files only have a fraction of their pixels decoded. Animated GIFs use their first frame.
+    """
+    mtime = file_mtime(path)
+    try:
+        with Image.open(path) as image:
+            return path, mtime, thumbnail_bytes(image, size)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Couldn't create thumbnail for {path}: {e}")
+        return path, mtime, None
+
+
+def make_thumbnails(paths, size=THUMBNAIL_SIZE):
+    """make_thumbnail for each of paths, handed to a worker process as one job."""
+    return [make_thumbnail(path, size) for path in paths]
+
+
+def thumbnail_pool(workers=THUMBNAIL_WORKERS):
+    """Process pool for ThumbnailAtlas.generate, meant to be kept and reused across runs.
+
+    Workers are spawned rather than forked. generate() runs on a thread of a process whose other threads may hold
+    locks at the time, and a forked worker would inherit those locks held forever.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def thumbnail_bytes(image, size=THUMBNAIL_SIZE):
+    """The raw RGBA bytes of an atlas slot holding image scaled down to fit size x size. image is modified."""
+    image.thumbnail((size, size), Image.LANCZOS, reducing_gap=3.0)
+    image = image.convert("RGBA")
+    slot = Image.new("RGBA", (size, size))
+    slot.paste(image, ((size - image.width) // 2, (size - image.height) // 2))
+    return slot.tobytes()
+
+
+class ThumbnailAtlas:
+    """Thumbnails of a collection packed into one memory-mapped file, as fixed-size raw RGBA slots.
+
+    The index maps each image path to the modification time its thumbnail was made from and its slot number, and is
+    kept next to the atlas as thumbnails/<name>.index. A thumbnail whose file has changed since is treated as missing
+    and regenerated into the same slot. get() wraps a slot of the map in a PIL image without copying it. The file
+    grows a segment at a time and each segment is mapped separately, so growing never moves or unmaps the slots that
+    images returned by get() point into.
+
+    Reads and writes can come from different threads, generate() is meant to run off the Tk thread.
+    """
+
+    def __init__(self, collection_path, directory=ATLAS_DIRECTORY, size=THUMBNAIL_SIZE):
+        self.size = size
+        self.slot_bytes = size * size * 4
+
+        # Segments are mapped at file offsets, which have to be multiples of the allocation granularity
+        aligned_slots = math.lcm(self.slot_bytes, mmap.ALLOCATIONGRANULARITY) // self.slot_bytes
+        self.segment_slots = math.ceil(SEGMENT_SLOTS / aligned_slots) * aligned_slots
+        self.segment_bytes = self.segment_slots * self.slot_bytes
+
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, atlas_name(collection_path))
+        self.atlas_path = base + ".atlas"
+        self.index_path = base + ".index"
+
+        # path -> (mtime, slot)
+        self.index = {}
+        self.slots_used = 0
+        if os.path.exists(self.atlas_path):
+            self.load_index()
+
+        self.lock = threading.Lock()
+        self.file = open(self.atlas_path, "r+b" if os.path.exists(self.atlas_path) else "w+b")
+        self.segments = []
+        for segment in range(os.fstat(self.file.fileno()).st_size // self.segment_bytes):
+            self.map_segment(segment)
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        # An atlas built with another thumbnail size is rebuilt from scratch
+        if data.get("size") == self.size:
+            self.index = data["index"]
+            self.slots_used = data["slots_used"]
+
+    def save_index(self):
+        with self.lock:
+            for segment in self.segments:
+                segment.flush()
+            data = {"size": self.size, "index": dict(self.index), "slots_used": self.slots_used}
+
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.index_path)
+
+    @property
+    def capacity(self):
+        return len(self.segments) * self.segment_slots
+
+    def map_segment(self, segment):
+        self.segments.append(mmap.mmap(self.file.fileno(), self.segment_bytes, offset=segment * self.segment_bytes))
+
+    def grow(self, slots):
+        while self.capacity < slots:
+            self.file.truncate((len(self.segments) + 1) * self.segment_bytes)
+            self.map_segment(len(self.segments))
+
+    def slot_view(self, slot):
+        segment, position = divmod(slot, self.segment_slots)
+        start = position * self.slot_bytes
+        return memoryview(self.segments[segment])[start:start + self.slot_bytes]
+
+    def close(self):
+        self.save_index()
+        with self.lock:
+            # Segments still used by images returned by get() are unmapped once those images are gone
+            self.segments = []
+            self.file.close()
+
+    # ----------------Lookups----------------
+
+    def slot(self, path, mtime=None):
+        """Slot of path's thumbnail, or None if there isn't one or the file has changed since it was made."""
+        entry = self.index.get(path)
+        if entry is None:
+            return None
+        if mtime is None:
+            mtime = file_mtime(path)
+        return entry[1] if entry[0] == mtime else None
+
+    def __contains__(self, path):
+        return self.slot(path) is not None
+
+    def get(self, path):
+        """The thumbnail of path as an RGBA PIL image backed by the atlas, or None if it is missing or stale."""
+        slot = self.slot(path)
+        if slot is None:
+            return None
+        with self.lock:
+            if slot >= self.capacity:
+                return None
+            buffer = self.slot_view(slot)
+        return Image.frombuffer("RGBA", (self.size, self.size), buffer, "raw", "RGBA", 0, 1)
+
+    def missing(self, paths):
+        return [path for path in paths if path not in self]
+
+    # ----------------Generation----------------
+
+    def put(self, path, mtime, data):
+        with self.lock:
+            entry = self.index.get(path)
+            if entry is not None:
+                slot = entry[1]
+            else:
+                slot = self.slots_used
+                self.slots_used += 1
+            self.grow(slot + 1)
+            self.slot_view(slot)[:] = data
+            self.index[path] = (mtime, slot)
+
+    def generate(self, paths, workers=THUMBNAIL_WORKERS, cancelled=None, executor=None):
+        """Create the missing thumbnails among paths in worker processes. Returns how many were added.
+
+        executor is a pool from thumbnail_pool() to run on, without one a pool is started for this run alone.
+        cancelled, if given, is checked between chunks of results and stops the run when it returns True, dropping
+        the chunks that haven't started so the pool is free for the next run.
+        """
+        paths = list(dict.fromkeys(self.missing(paths)))
+        if not paths:
+            return 0
+
+        own_executor = executor is None
+        if own_executor:
+            executor = thumbnail_pool(min(workers, len(paths)))
+
+        added = 0
+        futures = [executor.submit(make_thumbnails, paths[start:start + THUMBNAIL_CHUNK_SIZE], self.size)
+                   for start in range(0, len(paths), THUMBNAIL_CHUNK_SIZE)]
+        try:
+            for future in futures:
+                if cancelled is not None and cancelled():
+                    break
+                for path, mtime, data in future.result():
+                    if data is None:
+                        continue
+                    self.put(path, mtime, data)
+                    added += 1
+                    if added % INDEX_SAVE_INTERVAL == 0:
+                        self.save_index()
+        finally:
+            for future in futures:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        if added:
+            self.save_index()
+        return added
@@ -0,0 +1,149 @@
+import tkinter as tk
+
+from PIL import ImageTk
+
+GRID_BG = "grey20"
+PLACEHOLDER_BG = "grey35"
+SELECTED_OUTLINE = "lightsteelblue"
+
+# Space between thumbnails
+CELL_PADDING = 8
+
+
+class ThumbnailGrid(tk.Frame):
+    """Scrollable grid of the thumbnails of a group's images, read from a ThumbnailAtlas.
+
+    Only the rows on screen are drawn and only their thumbnails are turned into PhotoImages, so the grid costs the same
+    for a group of fifty images as for one of fifty thousand. Cells whose thumbnail isn't in the atlas yet show the
+    image name until refresh() finds it there. on_select is called with the index of a clicked image.
+    """
+
+    def __init__(self, parent, on_select, size):
+        super().__init__(parent, bg=GRID_BG)
+        self.on_select = on_select
+        self.size = size
+        self.cell = size + CELL_PADDING
+
+        self.atlas = None
+        self.images = []
+        self.selected = 0
+
+        # First row of thumbnails on screen
+        self.top_row = 0
+
+        # image index -> PhotoImage, for the cells on screen
+        self.photos = {}
+
+        self.canvas = tk.Canvas(self, bg=GRID_BG, highlightthickness=0, takefocus=0)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scrollbar, takefocus=0)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.canvas.bind("<Configure>", lambda event: self.render())
+        self.canvas.bind("<Button-1>", self.click)
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-4>", lambda event: self.scroll(-1))
+        self.canvas.bind("<Button-5>", lambda event: self.scroll(1))
+
+    def show(self, atlas, images, selected):
+        """Show images, highlighting the one at index selected."""
+        if atlas is not self.atlas or images is not self.images:
+            self.atlas = atlas
+            self.images = images
+            self.photos = {}
+            self.top_row = 0
+        self.select(selected)
+
+    def select(self, index):
+        """Highlight the image at index and scroll it into view, without calling on_select."""
+        self.selected = index
+        row = index // self.columns()
+        if not self.top_row <= row < self.top_row + self.visible_rows():
+            self.top_row = row - self.visible_rows() // 2
+        self.render()
+
+    def refresh(self):
+        """Redraw, picking up thumbnails added to the atlas since the last render."""
+        self.render()
+
+    # ----------------Layout----------------
+
+    def columns(self):
+        return max(1, self.canvas.winfo_width() // self.cell)
+
+    def visible_rows(self):
+        return max(1, self.canvas.winfo_height() // self.cell)
+
+    def row_count(self):
+        return -(-len(self.images) // self.columns())
+
+    def render(self):
+        columns = self.columns()
+        self.top_row = max(0, min(self.top_row, self.row_count() - self.visible_rows()))
+        self.canvas.delete("all")
+
+        # One extra row covers the partly visible one at the bottom
+        first = self.top_row * columns
+        last = min(len(self.images), first + (self.visible_rows() + 1) * columns)
+
+        photos = {}
+        for index in range(first, last):
+            row, column = divmod(index - first, columns)
+            x = column * self.cell + CELL_PADDING // 2
+            y = row * self.cell + CELL_PADDING // 2
+
+            photo = self.photos.get(index) or self.load_photo(index)
+            if photo is not None:
+                photos[index] = photo
+                self.canvas.create_image(x, y, anchor=tk.NW, image=photo)
+            else:
+                self.canvas.create_rectangle(x, y, x + self.size, y + self.size, fill=PLACEHOLDER_BG, width=0)
+                self.canvas.create_text(x + self.size // 2, y + self.size // 2, text=self.images[index].name,
+                                        width=self.size - 8, fill="white")
+
+            if index == self.selected:
+                self.canvas.create_rectangle(x - 2, y - 2, x + self.size + 2, y + self.size + 2,
+                                             outline=SELECTED_OUTLINE, width=3)
+
+        # PhotoImages of rows that scrolled out of view are let go
+        self.photos = photos
+
+        rows = self.row_count()
+        if rows:
+            self.scrollbar.set(self.top_row / rows, (self.top_row + self.visible_rows()) / rows)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def load_photo(self, index):
+        if self.atlas is None:
+            return None
+        thumbnail = self.atlas.get(self.images[index].path)
+        if thumbnail is None:
+            return None
+        return ImageTk.PhotoImage(thumbnail)
+
+    # ----------------Input----------------
+
+    def scroll(self, rows):
+        self.top_row += rows
+        self.render()
+
+    def on_mouse_wheel(self, event):
+        self.scroll(-1 if event.delta > 0 else 1)
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.top_row = int(float(amount) * self.row_count())
+            self.render()
+        elif unit == "pages":
+            self.scroll(int(amount) * self.visible_rows())
+        else:
+            self.scroll(int(amount))
+
+    def click(self, event):
+        column = event.x // self.cell
+        if column >= self.columns():
+            return
+        index = (self.top_row + event.y // self.cell) * self.columns() + column
+        if index < len(self.images):
+            self.on_select(index)
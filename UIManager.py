@@ -1,5 +1,6 @@
 import tkinter as tk
-import tkinter.ttk as ttk
+
+from GroupNavigator import GroupNavigator
 
 
 class UIManager:
@@ -12,8 +13,8 @@ class UIManager:
         # Attribute for advanced updates
         self.update_callback = update_callback
 
-        # Create notebook for groups (tab structure) and prevent traversal
-        self.notebook = ttk.Notebook(self.root, takefocus=0)
+        # Searchable group list, it only has widgets for the rows on screen however many groups there are
+        self.group_navigator = GroupNavigator(self.root, self.select_group)
 
         # Create frames for image details
         self.initialize_detail_frames()
@@ -50,40 +51,34 @@ class UIManager:
         self.group_visible = False
         self.gif_duration_visible = False
 
+        # Detail refreshes are batched, the last image and group asked for are shown once per idle cycle
+        self.shown_image = None
+        self.shown_group = None
+        self.details_job = None
+
 
     
 
     def create_notebook(self, groups):
-        # Add all groups to the notebook
-        for group in groups:
-            tab = tk.Frame(self.notebook)
-            self.notebook.add(tab, text=group.name)
-            # print(f"Added {group.name}")
+        # Add all groups to the navigator
+        self.group_navigator.set_groups(groups)
 
-        # Bind arrow keys to prevent tab traversal on notebook so that image traversal keybinds still work
-        self.notebook.bind("<Left>", self.lock_keybind)
-        self.notebook.bind("<Right>", self.lock_keybind)
+    def clear_notebook(self):
+        self.group_navigator.clear()
 
-    def update_notebook(self, current_group_name):
-        for i, tab_id in enumerate(self.notebook.tabs()):
+    def update_notebook(self, current_group):
+        self.group_navigator.select(current_group.group_id)
 
-            if self.notebook.tab(tab_id, "text") == current_group_name:
-                self.notebook.select(i)
-                break
+    def remove_notebook_tab(self, group):
+        self.group_navigator.remove(group)
 
-    def remove_notebook_tab(self, index):
-       self.notebook.forget(index)
+    def add_notebook_tab(self, group, index):
+        self.group_navigator.insert(group, index)
+
+    def select_group(self, group_id):
+        # Called when a group is picked in the navigator
+        self.update_callback("select_group", group_id=group_id)
 
-    def add_notebook_tab(self, name, index):
-    
-        tab = tk.Frame(self.notebook)
-        tabs_count = len(self.notebook.tabs())
-        
-        if index >= tabs_count:
-            self.notebook.add(tab, text=name)
-        else:
-            self.notebook.insert(index, tab, text=name)
-        
     def initialize_detail_frames(self):
         self.image_details = tk.Frame(self.root, bg="gainsboro", relief=tk.GROOVE, padx=10, pady=10)
         self.image_details_advanced = tk.Frame(self.root, bg="gainsboro", relief=tk.GROOVE, padx=10, pady=10)
@@ -344,48 +339,73 @@ class UIManager:
         self.set_duration_button.pack(side=tk.LEFT, padx=5, pady=5)
 
     def update_image_details(self, image, group = None):
+        # Only queue the refresh, flipping through images quickly then costs a single widget update
+        self.shown_image = image
+        if group is not None:
+            self.shown_group = group
+        if self.details_job is None:
+            self.details_job = self.root.after_idle(self.flush_image_details)
+
+    def flush_image_details(self):
+        """Write the queued image into the panels that are visible, hidden ones are filled in when shown."""
+        self.details_job = None
+        image = self.shown_image
+        if image is None:
+            return
+
         # Update the basic details
-        self.name_var.set(image.name)
-        self.group_var.set(image.group)
-        self.tags_var.set(", ".join(image.tags))
-        self.favorite_var.set("Yes" if image.favorite else "No")
+        if self.details_visible:
+            self.name_var.set(image.name)
+            self.group_var.set(image.group)
+            self.tags_var.set(", ".join(image.tags))
+            self.favorite_var.set("Yes" if image.favorite else "No")
 
         # Update the filename label
-        self.filename_label.config(text=image.name)
+        if self.name_visible:
+            self.filename_label.config(text=image.name)
 
         # Update the advanced details
-        self.zoom_var.set(str(image.zoom_level))
-        self.panx_var.set(str(image.panx))
-        self.pany_var.set(str(image.pany))
-        self.weight_var.set(str(image.weight))
-        self.series_var.set(image.series)
-        self.index_var.set(str(image.index))
-        self.path_var.set(str(image.path))
-
-        # Update default and preconfig values
-        self.default_zoom_var.set(str(image.default_zoom_level))
-        self.default_panx_var.set(str(image.default_panx))
-        self.default_pany_var.set(str(image.default_pany))
-
-        if image.preconfig:
-            self.preconfig_zoom_var.set(str(image.preconfig[2]))
-            self.preconfig_panx_var.set(str(image.preconfig[0]))
-            self.preconfig_pany_var.set(str(image.preconfig[1]))
-        else:
-            self.preconfig_zoom_var.set("")
-            self.preconfig_panx_var.set("")
-            self.preconfig_pany_var.set("")
+        if self.details_adv_visible:
+            self.zoom_var.set(str(image.zoom_level))
+            self.panx_var.set(str(image.panx))
+            self.pany_var.set(str(image.pany))
+            self.weight_var.set(str(image.weight))
+            self.series_var.set(image.series)
+            self.index_var.set(str(image.index))
+            self.path_var.set(str(image.path))
 
-        # Update current values
-        self.current_zoom_var.set(str(image.zoom_level))
-        self.current_panx_var.set(str(image.panx))
-        self.current_pany_var.set(str(image.pany))
+        if self.zoom_pan_visible:
+            # Update default and preconfig values
+            self.default_zoom_var.set(str(image.default_zoom_level))
+            self.default_panx_var.set(str(image.default_panx))
+            self.default_pany_var.set(str(image.default_pany))
+
+            if image.preconfig:
+                self.preconfig_zoom_var.set(str(image.preconfig[2]))
+                self.preconfig_panx_var.set(str(image.preconfig[0]))
+                self.preconfig_pany_var.set(str(image.preconfig[1]))
+            else:
+                self.preconfig_zoom_var.set("")
+                self.preconfig_panx_var.set("")
+                self.preconfig_pany_var.set("")
+
+            # Update current values
+            self.current_zoom_var.set(str(image.zoom_level))
+            self.current_panx_var.set(str(image.panx))
+            self.current_pany_var.set(str(image.pany))
 
         # Update the group details
+        if self.shown_group is not None:
+            self.update_group_details(self.shown_group)
 
         # Call the update callback to notify ImageViewerApp
         self.update_callback()
 
+    def refresh_shown_details(self):
+        # A panel was just shown, fill it in with the current image
+        if self.shown_image is not None:
+            self.update_image_details(self.shown_image)
+
     def lock_keybind(self, event):
             return
 
@@ -396,6 +416,7 @@ class UIManager:
             self.image_details.place_forget()
         else:
             self.image_details.place(anchor=tk.NE, relx=0.95, rely=0.05)
+            self.refresh_shown_details()
         self.details_visible = not self.details_visible
 
     def toggle_adv_details(self, event = None):
@@ -403,13 +424,14 @@ class UIManager:
             self.image_details_advanced.place_forget()
         else:
             self.image_details_advanced.place(anchor=tk.NW, relx=0, rely=0.05)
+            self.refresh_shown_details()
         self.details_adv_visible = not self.details_adv_visible
 
     def toggle_notebook(self, event = None):
         if self.notebook_visible:
-            self.notebook.place_forget()
+            self.group_navigator.place_forget()
         else:
-            self.notebook.place(relx=0.0, rely=0.0, anchor=tk.NW, relwidth=1)
+            self.group_navigator.place(relx=0.5, rely=0.0, anchor=tk.N, width=400)
         self.notebook_visible = not self.notebook_visible
     
     def toggle_controls(self, event = None):
@@ -432,6 +454,7 @@ class UIManager:
            self.filename_label.place_forget()
         else:
            self.filename_label.place(anchor=tk.NE, relx=1, rely=0.00)
+           self.refresh_shown_details()
         self.name_visible = not self.name_visible
 
     def toggle_zoom_pan(self, event = None):
@@ -439,6 +462,7 @@ class UIManager:
             self.zoom_pan_frame.place_forget()
         else:
             self.zoom_pan_frame.place(anchor=tk.NE, relx=0.95, rely=0.05)
+            self.refresh_shown_details()
         self.zoom_pan_visible = not self.zoom_pan_visible
         self.root.focus_set()
 
@@ -448,6 +472,7 @@ class UIManager:
             self.group_frame.place_forget()
         else:
             self.group_frame.place(anchor=tk.NE, relx=0.95, rely=0.15)
+            self.refresh_shown_details()
         self.group_visible = not self.group_visible
 
     def toggle_gif_duration_frame(self, event=None):
@@ -490,6 +515,10 @@ class UIManager:
                 print("Invalid range format. Use '-x,y' format.")
 
     def use_current_values(self):
+        # The current values may still be waiting for the next idle cycle
+        if self.details_job is not None:
+            self.root.after_cancel(self.details_job)
+            self.flush_image_details()
         self.zoom_entry.delete(0, tk.END)
         self.zoom_entry.insert(0, self.current_zoom_var.get())
         self.panx_entry.delete(0, tk.END)
@@ -532,6 +561,9 @@ class UIManager:
             self.update_callback("apply_current", zoom_level=zoom_level, panx=panx, pany=pany, default=default, preconfig=preconfig)
 
     def update_group_details(self, group):
+        self.shown_group = group
+        if not self.group_visible:
+            return
         current_group = group
         self.group_name_var.set(current_group.name)
         self.group_path_var.set(current_group.folder_path)
@@ -0,0 +1,55 @@
+import random
+import unittest
+
+from RandomDraw import FenwickTree, RandomDraw
+from Structures import Group, SmartImage
+
+
+def make_group(weights):
+    group = Group("group", "group")
+    group.images = [SmartImage(f"{i}.png", f"{i}.png", group, weight=weight) for i, weight in enumerate(weights)]
+    return group
+
+
+class RandomDrawTest(unittest.TestCase):
+    def test_window_longer_than_collection(self):
+        group = make_group([0.1, 0.2, 0.7, 0.3, 0.6])
+        for seed in range(500):
+            draw = RandomDraw([group], no_repeat=20, rng=random.Random(seed))
+            try:
+                drawn = [draw.draw()[1] for _ in range(60)]
+            finally:
+                draw.close()
+
+            # The window is capped at 4, so every run of 5 draws covers each image once
+            for start in range(len(drawn) - 4):
+                self.assertEqual(len(set(drawn[start:start + 5])), 5, f"seed {seed}: {drawn}")
+
+    def test_zero_weights_are_never_drawn(self):
+        group = make_group([0.0, 0.3, 0.0, 0.0, 0.5, 0.0])
+        draw = RandomDraw([group], no_repeat=100, rng=random.Random(1))
+        try:
+            drawn = {draw.draw()[1] for _ in range(200)}
+        finally:
+            draw.close()
+        self.assertEqual(drawn, {1, 4})
+
+    def test_nothing_drawable(self):
+        group = make_group([0.0, 0.0])
+        draw = RandomDraw([group], no_repeat=5)
+        try:
+            self.assertIsNone(draw.draw())
+        finally:
+            draw.close()
+
+    def test_find_skips_zero_weights_at_a_boundary(self):
+        tree = FenwickTree([0.1, 0.2, 0.0, 0.0, 0.7])
+        # Exactly at the end of the second range, the next positive weight is taken
+        self.assertEqual(tree.find(tree.weights[0] + tree.weights[1]), 4)
+        tree.update(4, 0.0)
+        # Past the last positive weight, the last one before is taken
+        self.assertEqual(tree.find(tree.total), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()